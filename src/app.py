@@ -1,755 +1,1019 @@
 import dash
-from dash import dcc, html, dash_table
+from dash import dcc, html, dash_table, Patch, no_update
 from dash.dependencies import Input, Output
 import plotly.graph_objs as go
 import pandas as pd
 import numpy as np
 import random
-from openai import OpenAI
-from openai.types.beta.assistant_stream_event import ThreadMessageDelta
-from openai.types.beta.threads.text_delta_block import TextDeltaBlock
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ALL, ClientsideFunction, Input, Output, State
+from dash.long_callback import DiskcacheManager
+import diskcache
+import os
+import re
+import tempfile
+import uuid
+from cube import GroupAggregate, Selection, moving_average_trend, topic_matrix, topic_order
+from significance import significance
+from topics import DASHBOARD_TOPICS
+from dataset import load_dataset, read_summary, days_to_datetime, to_day
+from review_store import ReviewStore
+from result_cache import ResultCache
+from memstats import process_memory
+from payload_stats import PayloadStats
+from metrics import Metrics
+from flask import jsonify, request
+from werkzeug.utils import secure_filename
+from chat import ChatSessions, stream_reply, stream_with_progress
 
 
 # Initialize the OpenAI client and assistant
 ASSISTANT_ID = 'asst_KSTLeF177cgnytEsMq5skwkl'
 
-# Load the dataset
-data = pd.read_csv("google_reviews_data.csv")
-data['date'] = pd.to_datetime(data['date'])
+DATA_PATH = "google_reviews_data.csv"
 
-preselected_standort = random.choice(data['name'].unique())
+# FAST_START=1 answers requests right away: the dataset is loaded in a background thread
+# and the page is built from the snapshot metadata until then (needs a current snapshot,
+# see dataset.py). /ready tells when the data is there.
+summary = read_summary(DATA_PATH) if os.environ.get('FAST_START') == '1' else None
+
+REVIEWS_PAGE_SIZE = 20
 
 # List of topics
-topics = ['Kundenservice', 'Beratung', 'Freundlichkeit', 'Fahrzeugübergabe', 'Zubehör', 'Werkstattservice', 'Preis-Leistungs-Verhältnis', 'Sauberkeit', 'Zuverlässigkeit', 'Terminvereinbarung', 'Lieferzeit', 'Garantieabwicklung', 'Reparaturqualität', 'Auswahl']
+topics = DASHBOARD_TOPICS
+
+# Memoized dashboard results, keyed on the normalized filter state and the dataset version
+result_cache = ResultCache.from_env()
+
+# The dataset (memory-mapped snapshot if one was built, see dataset.py) with its search index
+# (stored in the snapshot or built from the texts), the location x quarter x topic cube the
+# panels are built from and the review table backend. New review exports dropped into
+# REVIEW_DROP_DIR are appended to all of them at runtime.
+review_store_options = dict(drop_dir=os.environ.get('REVIEW_DROP_DIR', 'drops'),
+                            poll_interval=int(os.environ.get('REVIEW_DROP_INTERVAL', 30)))
+if summary:
+    reviews = ReviewStore.in_background(lambda: load_dataset(DATA_PATH), summary, topics, result_cache, **review_store_options)
+else:
+    data = load_dataset(DATA_PATH)
+    result_cache.version = data.version
+    reviews = ReviewStore(data, topics, result_cache, **review_store_options)
+
+preselected_standort = random.choice(list(reviews.summary().locations))
 
 # External stylesheet for Roboto Condensed font
 external_stylesheets = ['https://fonts.googleapis.com/css2?family=Roboto+Condensed:wght@300;400;700&display=swap', '/assets/custom_styles.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+
+# Background callbacks (the chat) run as jobs outside the request; job results, progress and
+# the chat thread id live in a disk cache every gunicorn worker can read
+background_cache = diskcache.Cache(os.environ.get('BACKGROUND_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'customerxm-jobs')))
+background_manager = DiskcacheManager(background_cache, expire=600)
+
+# Per-session chat state, dropped after CHAT_IDLE_TIMEOUT seconds without a question
+chat_sessions = ChatSessions(background_cache, idle_timeout=int(os.environ.get('CHAT_IDLE_TIMEOUT', 3600)))
+
+# Messages kept on the page per session; the assistant thread still has the whole conversation
+CHAT_HISTORY_LIMIT = 40
+
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, background_callback_manager=background_manager)
 server = app.server
 
-app.layout = html.Div([
-    html.Div([
-    html.Div([
-        html.Div([], style={'width': '80%'}),  # Empty 80% column
-        
-        html.Div([
-            html.H3('Anzahl Freitexte', className='header', style={'color': 'white', "marginBottom": "0px", "marginTop": "12px"}),
-            html.P(id='respondent-count', style={'fontSize': '20px', 'marginTop': '0px', "marginBottom": "2px", 'color': 'white', 'textAlign': 'right'})
-        ], style={'width': '30%', 'padding': '20px', 'border-radius': '10px', 'display': 'flex', 'flexDirection': 'column', 'justifyContent': 'flex-end', 'alignItems': 'flex-end'})
-    ], style={'display': 'flex', 'width': '100%'})
-], style={
-    'background-color': '#3A4D9F',  # Blue background
-    'background-image': 'url(assets/header_feedbackexplorer.png)',
-    'background-size': 'cover',
-    'background-position': 'center',
-    'border-radius': '10px',
-    'margin-bottom': '10px',
-    'padding': '20px',
-    'display': 'flex'
-}),
 
-    html.Div([
+# Unique vs. shared memory of the worker that serves the request (see gunicorn.conf.py)
+@server.route('/debug/memory')
+def memory_usage():
+    return jsonify(process_memory())
+
+
+# Hit/miss counters of the result cache in the worker that serves the request
+@server.route('/debug/cache')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+# Serialized size of every callback output, set PAYLOAD_REPORT=1 to record it
+payload_stats = PayloadStats.from_env(server)
+
+
+@server.route('/debug/payload')
+def payload_report():
+    return jsonify(payload_stats.report())
+
+
+# Stage timers, request latencies and cache/ingest counters of all workers on /metrics, set
+# METRICS=1 to collect them. PROFILE_SLOW_REQUESTS=<seconds> writes sampled stacks of slower
+# requests to PROFILE_DIR (see metrics.py).
+metrics = Metrics.from_env(server, background_cache)
+metrics.count_from(lambda: {
+    'customerxm_result_cache_hits_total': result_cache.hits,
+    'customerxm_result_cache_misses_total': result_cache.misses,
+    'customerxm_ingested_files_total': reviews.stats['files_ingested'],
+    'customerxm_ingest_failures_total': reviews.stats['files_failed'],
+    'customerxm_ingested_reviews_total': reviews.stats['reviews_ingested'],
+    'customerxm_ingest_seconds_total': reviews.stats['ingest_seconds'],
+})
+metrics.gauge('customerxm_reviews', lambda: len(reviews.current.data) if reviews.ready else 0)
+metrics.gauge('customerxm_result_cache_entries', lambda: len(result_cache.backend))
+
+
+# Readiness probe (e.g. Render's health check path): 503 until the reviews are loaded
+@server.route('/ready')
+def readiness():
+    if not reviews.ready:
+        return jsonify(ready=False, error=repr(reviews.load_error) if reviews.load_error else None), 503
+    data = reviews.current.data
+    return jsonify(ready=True, reviews=len(data), version=data.version)
+
+
+@server.before_request
+def watch_review_drops():
+    reviews.ensure_watching()
+
+
+# Upload of a new review export, e.g.
+#   curl -H "Authorization: Bearer $INGEST_TOKEN" -F file=@reviews.csv https://.../ingest
+# The file goes into the drop directory, so the other workers pick it up on their next poll.
+@server.route('/ingest', methods=['POST'])
+def ingest_reviews():
+    token = os.environ.get('INGEST_TOKEN')
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify(error='forbidden'), 403
+    file = request.files.get('file')
+    name = secure_filename(file.filename) if file else ''
+    if not name.endswith('.csv'):
+        return jsonify(error='expected a .csv file'), 400
+    if name in reviews.ingested:
+        return jsonify(error=f'{name} was already ingested'), 409
+    reviews.save_upload(file, name)
+    added = reviews.poll()
+    current = reviews.current.data
+    return jsonify(added=added, reviews=len(current), version=current.version)
+
+# Built on every page load, so locations and dates added by an ingestion show up
+def default_group_name(index):
+    return f'Selektion {chr(ord("A") + index)}' if index < 26 else f'Selektion {index + 1}'
+
+
+def group_filter(index, name, locations, value):
+    # The group name is editable, it's the column and legend label of the group
+    return html.Div([
+        html.H3('Selektion auswählen:', className='header'),
+        dcc.Input(id={'type': 'group-name', 'index': index}, value=name, debounce=True,
+                  style={'fontFamily': 'Roboto Condensed', 'marginBottom': '10px', 'width': '100%'}),
+        dcc.Dropdown(
+            id={'type': 'group-filter', 'index': index},
+            options=[{'label': location, 'value': location} for location in locations],
+            value=value,
+            multi=True
+        )
+    ], className='box', style={'width': '85%'})
+
+
+def serve_layout():
+    summary = reviews.summary()
+    locations = summary.locations
+    return html.Div([
         html.Div([
-            html.H3('Analyse', className='header_menu')
-        ], className='box_menu', style={'width': '25%',}),
-        
         html.Div([
-            html.H3('Treiberanalyse', className='header_menu')
-        ], className='box_menu', style={'width': '25%',}),
+            html.Div([], style={'width': '80%'}),  # Empty 80% column
         
-        html.Div([
-            html.H3('#ChatWithYourFeedback', className='header_menu')
-        ], className='box_menu', style={'width': '25%', }),
+            html.Div([
+                html.H3('Anzahl Freitexte', className='header', style={'color': 'white', "marginBottom": "0px", "marginTop": "12px"}),
+                html.P(id='respondent-count', style={'fontSize': '20px', 'marginTop': '0px', "marginBottom": "2px", 'color': 'white', 'textAlign': 'right'})
+            ], style={'width': '30%', 'padding': '20px', 'border-radius': '10px', 'display': 'flex', 'flexDirection': 'column', 'justifyContent': 'flex-end', 'alignItems': 'flex-end'})
+        ], style={'display': 'flex', 'width': '100%'})
+    ], style={
+        'background-color': '#3A4D9F',  # Blue background
+        'background-image': 'url(assets/header_feedbackexplorer.png)',
+        'background-size': 'cover',
+        'background-position': 'center',
+        'border-radius': '10px',
+        'margin-bottom': '10px',
+        'padding': '20px',
+        'display': 'flex'
+    }),
 
         html.Div([
-            html.H3('Impressum', className='header_menu')
-        ], className='box_menu', style={'width': '25%', })
-    ], className='container_menu', style={'display': 'flex', 'justify-content': 'space-between'}),
+            html.Div([
+                html.H3('Analyse', className='header_menu')
+            ], className='box_menu', style={'width': '25%',}),
+        
+            html.Div([
+                html.H3('Treiberanalyse', className='header_menu')
+            ], className='box_menu', style={'width': '25%',}),
+        
+            html.Div([
+                html.H3('#ChatWithYourFeedback', className='header_menu')
+            ], className='box_menu', style={'width': '25%', }),
+
+            html.Div([
+                html.H3('Impressum', className='header_menu')
+            ], className='box_menu', style={'width': '25%', })
+        ], className='container_menu', style={'display': 'flex', 'justify-content': 'space-between'}),
     
     
 
-    html.Div([
         html.Div([
-             html.H3('Selektion A auswählen:', className='header'),
-            dcc.Dropdown(
-                id='main-standort1-filter',
-                options=[{'label': name, 'value': name} for name in data['name'].unique()],
-                value=[preselected_standort],  # Preselect one Standort
-                multi=True
-            )
-        ], className='box', style={'width': '85%'}),
+            # One box per comparison group, more are added with the button below
+            html.Div(id='group-filters', children=[
+                group_filter(0, default_group_name(0), locations, [preselected_standort]),  # Preselect one Standort
+                group_filter(1, default_group_name(1), locations, []),
+            ], style={'display': 'contents'}),
+
+            html.Div([
+                html.H3('Wettbewerber auswählen:', className='header'),
+                dcc.Dropdown(
+                    id='competitor-filter',
+                    options=[{'label': name, 'value': name} for name in locations],
+                    value=[],
+                    multi=True
+                ),
+                html.Button('+ Selektion', id='add-group-button', n_clicks=0, style={'fontFamily': 'Roboto Condensed', 'marginTop': '10px', 'padding': '5px 10px'})
+            ], className='box', style={'width': '85%'}),
+
+            html.Div([
+                html.H3('Zeitraum:', className='header'),
+                dcc.DatePickerRange(
+                    id='period-filter',
+                    start_date=pd.Timestamp(days_to_datetime(summary.first_day)).date(),
+                    end_date=pd.Timestamp(days_to_datetime(summary.last_day)).date(),
+                    display_format='DD.MM.YYYY',
+                    month_format='DD.MM.YYYY',
+                    style={'fontSize': '10px'}
+                )
+            ], className='box', style={'width': '85%'}),
+        ], className='container'),
 
-        html.Div([
-            html.H3('Selektion B auswählen:', className='header'),
-            dcc.Dropdown(
-                id='main-standort2-filter',
-                options=[{'label': name, 'value': name} for name in data['name'].unique()],
-                value=[],
-                multi=True
-            )
-        ], className='box', style={'width': '85%'}),
 
         html.Div([
-            html.H3('Wettbewerber auswählen:', className='header'),
-            dcc.Dropdown(
-                id='competitor-filter',
-                options=[{'label': name, 'value': name} for name in data['name'].unique()],
-                value=[],
-                multi=True
-            )
-        ], className='box', style={'width': '85%'}),
-    ], className='container'),
+            html.Div([
+                html.H3('Status', className='header'),
+                dcc.Graph(id='average-satisfaction-bar', config={'displayModeBar': False})
+            ], className='box', style={'width': '40%'}),
 
+            html.Div([
+                html.H3('Entwicklung', className='header'),
+                dcc.Graph(id='satisfaction-trend', config={'displayModeBar': False})
+            ], className='box', style={'width': '60%'})
+        ], className='container'),
 
-    html.Div([
         html.Div([
-            html.H3('Status', className='header'),
-            dcc.Graph(id='average-satisfaction-bar', config={'displayModeBar': False})
-        ], className='box', style={'width': '40%'}),
+            html.Div([
+                html.H3('🗺️ Discover Key Topics', className='header_manual'),
+                html.P("""Diese Tabelle zeigt die häufigsten Themen in den Kundenbewertungen. 
+                       Vergleichen Sie, wie oft diese Themen bei verschiedenen Unternehmen vorkommen, 
+                       und identifizieren Sie wichtige Themenbereiche.""",  style={'color': 'white', 'fontSize': '18px' })
+            ], className='box_text', style={'flex': '1'}),
+
+            html.Div([
+                html.H3('Topic Sensitivity Meter', className='header dark-text'),
+                html.P("""Stellen Sie mit diesem Schieberegler ein, ab welcher Differenz 
+                       in Prozentpunkten die Themen farblich hervorgehoben werden. Passen Sie die Sensibilität an, 
+                       um relevante Unterschiede sichtbar zu machen.""",  style={'color': 'black', 'fontSize': '14px' }),
+                dcc.Slider(
+                    id='threshold-slider',
+                    min=0,
+                    max=20,
+                    step=1,
+                    value=10,
+                    marks={i: f'{i}%' for i in range(0, 31, 5)}
+                ),
+                dcc.Checklist(
+                    id='threshold-significance',
+                    options=[{'label': ' Nur statistisch signifikante Unterschiede hervorheben', 'value': 'significant'}],
+                    value=[],
+                    style={'color': 'black', 'fontSize': '14px', 'marginTop': '10px'}
+                )
+            ], className='box', style={'flex': '1'})
+        ], className='container'),
 
         html.Div([
-            html.H3('Entwicklung', className='header'),
-            dcc.Graph(id='satisfaction-trend', config={'displayModeBar': False})
-        ], className='box', style={'width': '60%'})
-    ], className='container'),
+            dash_table.DataTable(
+                id='topic-heatmap',
+                style_table={'height': '300px', 'overflowY': 'auto'},
+                style_cell={'textAlign': 'left', 'padding': '5px', 'font-family': 'Roboto Condensed, sans-serif'},
+                style_header={'backgroundColor': '#D9D9D9', 'fontWeight': 'bold', 'font-family': 'Roboto Condensed, sans-serif'},
+                style_data={'whiteSpace': 'normal', 'height': 'auto'},
+                style_data_conditional=[]
+            )
+        ], className='box', style={'marginTop': '20px', 'marginBottom': '20px'}),
 
-    html.Div([
         html.Div([
-            html.H3('🗺️ Discover Key Topics', className='header_manual'),
-            html.P("""Diese Tabelle zeigt die häufigsten Themen in den Kundenbewertungen. 
-                   Vergleichen Sie, wie oft diese Themen bei verschiedenen Unternehmen vorkommen, 
-                   und identifizieren Sie wichtige Themenbereiche.""",  style={'color': 'white', 'fontSize': '18px' })
-        ], className='box_text', style={'flex': '1'}),
+            html.Div([
+                html.H3('Rating Sensitivity Meter', className='header'),
+                html.P("""Stellen Sie ein, ab welcher Differenz in den Durchschnittsbewertungen (1 bis 5) die Werte 
+                       farblich hervorgehoben werden. Schon kleine Unterschiede können signifikant sein.""",  style={'color': 'black', 'fontSize': '14px' }),
+                dcc.Slider(
+                    id='rating-threshold-slider',
+                    min=0.1,
+                    max=1.0,
+                    step=0.1,
+                    value=0.2,
+                    marks={round(float(i), 1): f'{i:.1f}' for i in np.arange(0.1, 1.6, 0.1)}
+                
+                ),
+                dcc.Checklist(
+                    id='rating-threshold-significance',
+                    options=[{'label': ' Nur statistisch signifikante Unterschiede hervorheben', 'value': 'significant'}],
+                    value=[],
+                    style={'color': 'black', 'fontSize': '14px', 'marginTop': '10px'}
+                )
+            ], className='box', style={'flex': '1'}),
 
-        html.Div([
-            html.H3('Topic Sensitivity Meter', className='header dark-text'),
-            html.P("""Stellen Sie mit diesem Schieberegler ein, ab welcher Differenz 
-                   in Prozentpunkten die Themen farblich hervorgehoben werden. Passen Sie die Sensibilität an, 
-                   um relevante Unterschiede sichtbar zu machen.""",  style={'color': 'black', 'fontSize': '14px' }),
-            dcc.Slider(
-                id='threshold-slider',
-                min=0,
-                max=20,
-                step=1,
-                value=10,
-                marks={i: f'{i}%' for i in range(0, 31, 5)}
-            )
-        ], className='box', style={'flex': '1'})
-    ], className='container'),
+            html.Div([
+                html.H3('💡 Understand Review Sentiment', className='header_manual'),
+                html.P("""Hier sehen Sie die durchschnittliche Bewertung für jedes Schlüsselthema. 
+                       Erkennen Sie, ob ein Thema positiv oder negativ bewertet wurde, und nutzen Sie diese 
+                       Erkenntnisse zur Identifikation von Stärken und Schwächen.""", style={'color': 'white', 'fontSize': '18px' })
+            ], className='box_text', style={'flex': '1'})
+        ], className='container'),
 
     html.Div([
-        dash_table.DataTable(
-            id='topic-heatmap',
-            style_table={'height': '300px', 'overflowY': 'auto'},
-            style_cell={'textAlign': 'left', 'padding': '5px', 'font-family': 'Roboto Condensed, sans-serif'},
-            style_header={'backgroundColor': '#D9D9D9', 'fontWeight': 'bold', 'font-family': 'Roboto Condensed, sans-serif'},
-            style_data={'whiteSpace': 'normal', 'height': 'auto'},
-            style_data_conditional=[]
-        )
-    ], className='box', style={'marginTop': '20px', 'marginBottom': '20px'}),
+            dash_table.DataTable(
+                id='average-rating-table',
+                style_table={'height': '300px', 'overflowY': 'auto'},
+                style_cell={'textAlign': 'left', 'padding': '5px', 'font-family': 'Roboto Condensed, sans-serif'},
+                style_header={'backgroundColor': '#D9D9D9', 'fontWeight': 'bold', 'font-family': 'Roboto Condensed, sans-serif'},
+                style_data={'whiteSpace': 'normal', 'height': 'auto'},
+                style_data_conditional=[]
+            ),
+            html.Div(id='asterisk-explanation', style={'fontSize': '12px', 'color': 'grey', 'marginTop': '10px'})
+        ], className='box', style={'marginTop': '20px', 'marginBottom': '20px'}),
+
 
-    html.Div([
         html.Div([
-            html.H3('Rating Sensitivity Meter', className='header'),
-            html.P("""Stellen Sie ein, ab welcher Differenz in den Durchschnittsbewertungen (1 bis 5) die Werte 
-                   farblich hervorgehoben werden. Schon kleine Unterschiede können signifikant sein.""",  style={'color': 'black', 'fontSize': '14px' }),
-            dcc.Slider(
-                id='rating-threshold-slider',
-                min=0.1,
-                max=1.0,
-                step=0.1,
-                value=0.2,
-                marks={i: f'{i:.1f}' for i in np.arange(0.1, 1.6, 0.1)}
-                
-            )
-        ], className='box', style={'flex': '1'}),
+            html.H3("🕵️ Deep Dive - Explore Your Data", className='header_manual', style={'textAlign': 'center',  }),
+            html.P("""Tauchen Sie tief in die Kundenbewertungen ein und analysieren Sie spezifische Feedbacks. 
+                   Nutzen Sie die Filter, um nach Themen, Unternehmen, Zeiträumen, Bewertungen und Suchbegriffen zu suchen. 
+                   Diese Funktion ermöglicht es Ihnen, detaillierte Einblicke zu gewinnen und gezielt auf Kundenfeedback zu reagieren.""", style={'textAlign': 'center', 'color': '#fff', 'fontSize': '18px' }),
+        ], className='box_text', style={'marginTop': '20px', 'marginBottom': '0px'} ),
+
 
         html.Div([
-            html.H3('💡 Understand Review Sentiment', className='header_manual'),
-            html.P("""Hier sehen Sie die durchschnittliche Bewertung für jedes Schlüsselthema. 
-                   Erkennen Sie, ob ein Thema positiv oder negativ bewertet wurde, und nutzen Sie diese 
-                   Erkenntnisse zur Identifikation von Stärken und Schwächen.""", style={'color': 'white', 'fontSize': '18px' })
-        ], className='box_text', style={'flex': '1'})
-    ], className='container'),
-
-html.Div([
-        dash_table.DataTable(
-            id='average-rating-table',
-            style_table={'height': '300px', 'overflowY': 'auto'},
-            style_cell={'textAlign': 'left', 'padding': '5px', 'font-family': 'Roboto Condensed, sans-serif'},
-            style_header={'backgroundColor': '#D9D9D9', 'fontWeight': 'bold', 'font-family': 'Roboto Condensed, sans-serif'},
-            style_data={'whiteSpace': 'normal', 'height': 'auto'},
-            style_data_conditional=[]
-        ),
-        html.Div(id='asterisk-explanation', style={'fontSize': '12px', 'color': 'grey', 'marginTop': '10px'})
-    ], className='box', style={'marginTop': '20px', 'marginBottom': '20px'}),
+            html.Div([
+                html.H3('Thema:', className='header'),
+                dcc.Dropdown(
+                    id='topic-dropdown',
+                    options=[{'label': topic, 'value': topic} for topic in topics],
+                    value=topics[0],
+                    clearable=False
+                )
+            ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
+
+            html.Div([
+                html.H3('Betrieb:', className='header'),
+                dcc.Dropdown(
+                    id='standort-dropdown',
+                    options=[{'label': name, 'value': name} for name in locations],
+                    value=locations[0],
+                    clearable=False
+                )
+            ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
+
+            html.Div([
+                html.H3('Zeitspanne:', className='header'),
+                dcc.DatePickerRange(
+                    id='date-picker-range',
+                    start_date=pd.Timestamp(days_to_datetime(summary.first_day)).date(),
+                    end_date=pd.Timestamp(days_to_datetime(summary.last_day)).date(),
+                    display_format='DD.MM.YYYY',
+                    month_format='DD.MM.YYYY',
+                    style={'fontSize': '10px'}
+                )
+            ], style={'width': '25%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
+
+            html.Div([
+                html.H3('Rating Range:', className='header'),
+                dcc.RangeSlider(
+                    id='review-rating-slider',
+                    min=1,
+                    max=5,
+                    step=1,
+                    value=[1, 3],
+                    marks={i: f'{i}' for i in range(1, 6)}
+                )
+            ], style={'width': '15%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
+
+            html.Div([
+                html.H3('Suchbegriff:', className='header'),
+                dcc.Input(
+                    id='search-term',
+                    type='text',
+                    placeholder='Suchbegriff eingeben'
+                )
+            ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top', })
+        ], className='box', style={'marginTop': '20px', 'marginBottom': '20px', 'display': 'flex'}),
 
+        html.Div([
+            dash_table.DataTable(
+                id='filtered-reviews-table',
+                # Paging, sorting and filtering run on the server, only the visible page is sent
+                page_action='custom',
+                page_current=0,
+                page_size=REVIEWS_PAGE_SIZE,
+                sort_action='custom',
+                sort_mode='single',
+                sort_by=[],
+                filter_action='custom',
+                filter_query='',
+                style_table={'height': '300px', 'overflowY': 'auto'},
+                style_cell={'textAlign': 'left', 'padding': '5px', 'font-family': 'Roboto Condensed, sans-serif'},
+                style_header={'backgroundColor': '#D9D9D9', 'fontWeight': 'bold', 'font-family': 'Roboto Condensed, sans-serif'},
+                style_data={'whiteSpace': 'normal', 'height': 'auto'},
+                style_data_conditional=[
+                    {'if': {'row_index': 'odd'}, 'backgroundColor': '#F5F4EF'},
+                    {'if': {'row_index': 'even'}, 'backgroundColor': 'white'}
+                ]
+            ),
+            html.Div(id='filtered-reviews-count', style={'fontSize': '12px', 'color': 'grey', 'marginTop': '10px'})
+        ], className='box', style={'marginTop': '20px', 'marginBottom': '20px'}),
 
-    html.Div([
-        html.H3("🕵️ Deep Dive - Explore Your Data", className='header_manual', style={'textAlign': 'center',  }),
-        html.P("""Tauchen Sie tief in die Kundenbewertungen ein und analysieren Sie spezifische Feedbacks. 
-               Nutzen Sie die Filter, um nach Themen, Unternehmen, Zeiträumen, Bewertungen und Suchbegriffen zu suchen. 
-               Diese Funktion ermöglicht es Ihnen, detaillierte Einblicke zu gewinnen und gezielt auf Kundenfeedback zu reagieren.""", style={'textAlign': 'center', 'color': '#fff', 'fontSize': '18px' }),
-    ], className='box_text', style={'marginTop': '20px', 'marginBottom': '0px'} ),
 
 
     html.Div([
-        html.Div([
-            html.H3('Thema:', className='header'),
-            dcc.Dropdown(
-                id='topic-dropdown',
-                options=[{'label': topic, 'value': topic} for topic in topics],
-                value=topics[0],
-                clearable=False
-            )
-        ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
+            html.H3("💬 ChatWithYourFeedback", className='header_manual', style={'textAlign': 'center'}),
+            html.P("""Fragen Sie den Chatbot z. B. >> Bitte schaue dir die 1-Sterne Bewertungen von Freistaat Caravaning an,
+                   die das Thema Freundlichkeit aufgreifen. Welchen Themen tauchen darin auf? <<""", style={'textAlign': 'center', 'fontSize': '16px', 'marginBottom': '20px'}),
+            dcc.Input(id='input-text', type='text', value='', placeholder='Was möchte Sie erfahren?', style={'width': '80%', 'height': '50px', 'fontSize': '18px', 'paddingLeft': '10px', 'fontFamily': 'Roboto Condensed'}),
+            html.Button(id='submit-button', n_clicks=0, children='Submit', style={'fontSize': '18px', 'fontFamily': 'Roboto Condensed', 'marginRight': '20px', 'padding': '10px 20px'}),
+            dcc.Store(id='chat-session'),
+            html.Div(id='chat-history', children=[], style={'whiteSpace': 'pre-line', 'marginTop': '20px'}),
+            # The question and the reply as far as it has been streamed, while a run is in progress
+            html.Div(id='chat-stream', style={'whiteSpace': 'pre-line', 'display': 'none'})
+        ], className='box_text', style={'marginTop': '20px', 'marginBottom': '20px', 'paddingLeft': '70px', 'paddingRight': '70px'}),
 
         html.Div([
-            html.H3('Betrieb:', className='header'),
-            dcc.Dropdown(
-                id='standort-dropdown',
-                options=[{'label': name, 'value': name} for name in data['name'].unique()],
-                value=data['name'].unique()[0],
-                clearable=False
-            )
-        ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
-
-        html.Div([
-            html.H3('Zeitspanne:', className='header'),
-            dcc.DatePickerRange(
-                id='date-picker-range',
-                start_date=data['date'].min().date(),
-                end_date=data['date'].max().date(),
-                display_format='DD.MM.YYYY',
-                month_format='DD.MM.YYYY',
-                style={'fontSize': '10px'}
-            )
-        ], style={'width': '25%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
+            html.H3("OpenAI API Key", className='header_manual', style={'textAlign': 'center'}),
+            dcc.Input(id='openai-api-key', type='password', placeholder='Enter your OpenAI API Key', style={'width': '80%', 'height': '50px', 'fontSize': '18px', 'paddingLeft': '10px', 'fontFamily': 'Roboto Condensed'}),
+        ], className='box_text', style={'marginTop': '20px', 'marginBottom': '20px', 'paddingLeft': '70px', 'paddingRight': '70px'})
+    
+    ], className='wrapper')
 
-        html.Div([
-            html.H3('Rating Range:', className='header'),
-            dcc.RangeSlider(
-                id='review-rating-slider',
-                min=1,
-                max=5,
-                step=1,
-                value=[1, 3],
-                marks={i: f'{i}' for i in range(1, 6)}
-            )
-        ], style={'width': '15%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '0 10px'}),
 
-        html.Div([
-            html.H3('Suchbegriff:', className='header'),
-            dcc.Input(
-                id='search-term',
-                type='text',
-                placeholder='Suchbegriff eingeben'
-            )
-        ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top', })
-    ], className='box', style={'marginTop': '20px', 'marginBottom': '20px', 'display': 'flex'}),
+app.layout = serve_layout
 
-    html.Div([
-        dash_table.DataTable(
-            id='filtered-reviews-table',
-            style_table={'height': '300px', 'overflowY': 'auto'},
-            style_cell={'textAlign': 'left', 'padding': '5px', 'font-family': 'Roboto Condensed, sans-serif'},
-            style_header={'backgroundColor': '#D9D9D9', 'fontWeight': 'bold', 'font-family': 'Roboto Condensed, sans-serif'},
-            style_data={'whiteSpace': 'normal', 'height': 'auto'},
-            style_data_conditional=[
-                {'if': {'row_index': 'odd'}, 'backgroundColor': '#F5F4EF'},
-                {'if': {'row_index': 'even'}, 'backgroundColor': 'white'}
-            ]
-        )
-    ], className='box', style={'marginTop': '20px', 'marginBottom': '20px'}),
 
+CHAT_STREAM_VISIBLE = {'whiteSpace': 'pre-line', 'display': 'block'}
+CHAT_STREAM_HIDDEN = {'whiteSpace': 'pre-line', 'display': 'none'}
 
 
-html.Div([
-        html.H3("💬 ChatWithYourFeedback", className='header_manual', style={'textAlign': 'center'}),
-        html.P("""Fragen Sie den Chatbot z. B. >> Bitte schaue dir die 1-Sterne Bewertungen von Freistaat Caravaning an,
-               die das Thema Freundlichkeit aufgreifen. Welchen Themen tauchen darin auf? <<""", style={'textAlign': 'center', 'fontSize': '16px', 'marginBottom': '20px'}),
-        dcc.Input(id='input-text', type='text', value='', placeholder='Was möchte Sie erfahren?', style={'width': '80%', 'height': '50px', 'fontSize': '18px', 'paddingLeft': '10px', 'fontFamily': 'Roboto Condensed'}),
-        html.Button(id='submit-button', n_clicks=0, children='Submit', style={'fontSize': '18px', 'fontFamily': 'Roboto Condensed', 'marginRight': '20px', 'padding': '10px 20px'}),
-        dcc.Loading(
-            id="loading-indicator",
-            type="default",
-            children=html.Div(id='chat-history', style={'whiteSpace': 'pre-line', 'marginTop': '20px'})
-        )
-    ], className='box_text', style={'marginTop': '20px', 'marginBottom': '20px', 'paddingLeft': '70px', 'paddingRight': '70px'}),
+def chat_bubble(role, content):
+    if role == 'user':
+        return html.Div(content, style={'backgroundColor': '#D3D3D3', 'padding': '10px', 'borderRadius': '10px', 'marginBottom': '10px', 'fontSize': '18px', 'color': 'black', 'textAlign': 'left', 'marginRight': '10%'})
+    return html.Div(content, style={'backgroundColor': 'white', 'color': 'black', 'padding': '10px', 'borderRadius': '10px', 'marginBottom': '10px', 'fontSize': '18px', 'textAlign': 'left', 'marginLeft': '10%'})
 
-    html.Div([
-        html.H3("OpenAI API Key", className='header_manual', style={'textAlign': 'center'}),
-        dcc.Input(id='openai-api-key', type='password', placeholder='Enter your OpenAI API Key', style={'width': '80%', 'height': '50px', 'fontSize': '18px', 'paddingLeft': '10px', 'fontFamily': 'Roboto Condensed'}),
-    ], className='box_text', style={'marginTop': '20px', 'marginBottom': '20px', 'paddingLeft': '70px', 'paddingRight': '70px'})
-    
-], className='wrapper')
 
+# Every page load starts its own chat session (and assistant thread on the first question)
+@app.callback(
+    Output('chat-session', 'data'),
+    Input('chat-session', 'modified_timestamp'),
+    State('chat-session', 'data')
+)
+def start_chat_session(_, session_id):
+    return no_update if session_id else uuid.uuid4().hex
 
-chat_history = []
 
+# The assistant run is a background job: the request returns right away, the browser
+# polls for progress and gets the reply streamed into chat-stream token by token.
+# Only the new question/reply pair is sent back and appended to the history.
+# Point OPENAI_BASE_URL at openai_stub.py to run this without the OpenAI API.
 @app.callback(
     Output('chat-history', 'children'),
     Input('submit-button', 'n_clicks'),
     State('input-text', 'value'),
-    State('chat-history', 'children'),
-    State('openai-api-key', 'value')
+    State('chat-session', 'data'),
+    State('openai-api-key', 'value'),
+    background=True,
+    interval=250,
+    progress=[Output('chat-stream', 'children')],
+    running=[
+        (Output('submit-button', 'disabled'), True, False),
+        (Output('chat-stream', 'style'), CHAT_STREAM_VISIBLE, CHAT_STREAM_HIDDEN)
+    ],
+    prevent_initial_call=True
 )
-def update_chat(n_clicks, user_query, history, api_key):
-    global chat_history
-    if n_clicks > 0 and user_query and api_key:
-        client = OpenAI(api_key=api_key)
-        assistant = client.beta.assistants.retrieve(assistant_id=ASSISTANT_ID)
-
-        # Append user message to chat history
-        chat_history.append({"role": "user", "content": user_query})
-
-        # Create a new thread if it does not exist
-        if 'thread_id' not in app.server.__dict__:
-            thread = client.beta.threads.create()
-            app.server.__dict__['thread_id'] = thread.id
-
-        thread_id = app.server.__dict__['thread_id']
-
-        # Check if a run is active and handle it
-        active_run = None
-        for run in client.beta.threads.runs.list(thread_id=thread_id):
-            if run.status == "running":
-                active_run = run
-                break
-
-        if active_run:
-            # Wait for the active run to complete
-            for event in client.beta.threads.runs.iterate(thread_id=thread_id, run_id=active_run.id):
-                if isinstance(event, ThreadMessageDelta) and event.data.is_completed:
-                    break
-
-        # Add user query to the thread
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=user_query
-        )
-
-        # Stream the assistant's reply
-        stream = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=ASSISTANT_ID,
-            stream=True
+def update_chat(set_progress, n_clicks, user_query, session_id, api_key):
+    if not (n_clicks > 0 and user_query and api_key and session_id):
+        return no_update
+    # Every job runs in a freshly forked process, so there's no client to reuse from earlier messages
+    from openai import OpenAI
+    client = OpenAI(api_key=api_key)
+    question = chat_bubble('user', user_query)
+    set_progress(([question, chat_bubble('assistant', '…')],))
+
+    # Saved as soon as the run exists, so a job killed mid-stream doesn't lose the thread
+    session = chat_sessions.get(session_id)
+    with metrics.stage('chat', 'reply'):
+        assistant_reply = stream_with_progress(
+            metrics.time_to_first(
+                stream_reply(client, ASSISTANT_ID, session, user_query, lambda session: chat_sessions.save(session_id, session)),
+                'chat', 'first_token'
+            ),
+            lambda reply: set_progress(([question, chat_bubble('assistant', reply)],))
         )
 
-        assistant_reply = ""
-        for event in stream:
-            if isinstance(event, ThreadMessageDelta):
-                if isinstance(event.data.delta.content[0], TextDeltaBlock):
-                    assistant_reply += event.data.delta.content[0].text.value
-
-        # Append assistant message to chat history
-        chat_history.append({"role": "assistant", "content": assistant_reply})
-
-        # Update chat history display
-        history_elements = []
-        for msg in chat_history:
-            if msg['role'] == 'user':
-                history_elements.append(
-                    html.Div(msg['content'], style={'backgroundColor': '#D3D3D3', 'padding': '10px', 'borderRadius': '10px', 'marginBottom': '10px', 'fontSize': '18px', 'color': 'black', 'textAlign': 'left', 'marginRight': '10%'})
-                )
-            else:
-                history_elements.append(
-                    html.Div(msg['content'], style={'backgroundColor': 'white', 'color': 'black', 'padding': '10px', 'borderRadius': '10px', 'marginBottom': '10px', 'fontSize': '18px', 'textAlign': 'left', 'marginLeft': '10%'})
-                )
-        return history_elements
+    history = Patch()
+    history.extend([question, chat_bubble('assistant', assistant_reply)])
+    session['messages'] += 2
+    # Drop the oldest messages from the page once the limit is reached
+    while session['messages'] > CHAT_HISTORY_LIMIT:
+        del history[0]
+        session['messages'] -= 1
+    chat_sessions.save(session_id, session)
+    # Job processes end with the job, so their numbers go to the shared totals right away
+    metrics.inc('customerxm_chat_messages_total')
+    metrics.flush()
     return history
 
 
 @app.callback(
-    [Output('average-satisfaction-bar', 'figure'),
-     Output('respondent-count', 'children'),
-     Output('satisfaction-trend', 'figure'),
-     Output('topic-heatmap', 'data'),
-     Output('topic-heatmap', 'columns'),
-     Output('topic-heatmap', 'style_data_conditional'),
-     Output('topic-heatmap', 'tooltip_data'),
-     Output('average-rating-table', 'data'),
-     Output('average-rating-table', 'columns'),
-     Output('average-rating-table', 'style_data_conditional'),
-     Output('average-rating-table', 'tooltip_data'),
-     Output('filtered-reviews-table', 'data'),
-     Output('filtered-reviews-table', 'columns'),
-     Output('asterisk-explanation', 'children')],
-    [Input('main-standort1-filter', 'value'),
-     Input('main-standort2-filter', 'value'),
-     Input('competitor-filter', 'value'),
-     Input('threshold-slider', 'value'),
-     Input('rating-threshold-slider', 'value'),
-     Input('topic-dropdown', 'value'),
-     Input('standort-dropdown', 'value'),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date'),
-     Input('review-rating-slider', 'value'),
-     Input('search-term', 'value')]
+    Output('group-filters', 'children'),
+    Input('add-group-button', 'n_clicks'),
+    prevent_initial_call=True
 )
-def update_dashboard(main_standort1, main_standort2, competitors, threshold, rating_threshold, selected_topic, selected_standort, start_date, end_date, review_rating, search_term):
-    # Combine the main standorte 1 into one group
-    if main_standort1:
-        main_data1 = data[data['name'].isin(main_standort1)]
-        main_data1['name'] = 'Selektion A'
-        main_data1['quarter'] = main_data1['date'].dt.to_period('Q')
-    else:
-        main_data1 = pd.DataFrame(columns=data.columns)
-
-    # Combine the main standorte 2 into one group
-    if main_standort2:
-        main_data2 = data[data['name'].isin(main_standort2)]
-        main_data2['name'] = 'Selektion B'
-        main_data2['quarter'] = main_data2['date'].dt.to_period('Q')
-    else:
-        main_data2 = pd.DataFrame(columns=data.columns)
-
-    # Combine the data for main standorte and competitors
-    competitor_data = data[data['name'].isin(competitors)]
-    competitor_data['quarter'] = competitor_data['date'].dt.to_period('Q')
-    filtered_data = pd.concat([main_data1, main_data2, competitor_data])
-
-    # Ensure all date columns are in datetime format
-    filtered_data['date'] = pd.to_datetime(filtered_data['date'])
-
-    # Calculate the overall average satisfaction for each selection
-    average_ratings = {}
-    colors = {
-        'Selektion A': '#b22122',
-        'Selektion B': '#141F52'
-    }
+def add_group(n_clicks):
+    # Appended with a Patch, the existing boxes and their picks stay as they are
+    index = n_clicks + 1
+    children = Patch()
+    children.append(group_filter(index, default_group_name(index), reviews.summary().locations, []))
+    return children
+
+
+# The comparison panels all read the group boxes (pattern-matched, any number of them),
+# the competitor picks and the period
+COMPARISON_INPUTS = [
+    Input({'type': 'group-name', 'index': ALL}, 'value'),
+    Input({'type': 'group-filter', 'index': ALL}, 'value'),
+    Input('competitor-filter', 'value'),
+    Input('period-filter', 'start_date'),
+    Input('period-filter', 'end_date'),
+]
+
+
+# The period applies to the deep dive too; its own date range can still be narrowed after
+@app.callback(
+    [Output('date-picker-range', 'start_date'),
+     Output('date-picker-range', 'end_date')],
+    [Input('period-filter', 'start_date'),
+     Input('period-filter', 'end_date')],
+    prevent_initial_call=True
+)
+def apply_period(start_date, end_date):
+    # A cleared end of the period means all reviews up to there, not an open range
+    summary = reviews.summary()
+    if not start_date:
+        start_date = pd.Timestamp(days_to_datetime(summary.first_day)).date()
+    if not end_date:
+        end_date = pd.Timestamp(days_to_datetime(summary.last_day)).date()
+    return start_date, end_date
+
+
+# Shared filtered-selection stage: every comparison panel reads the same
+# memoized group aggregates, so a change to one slider doesn't redo the others
+@result_cache.memoize
+def _build_selection(groups, competitors, period):
+    # Sum the cube cells of all groups and competitors in one pass instead of masking the raw reviews
+    cube = reviews.current.cube
+    aggregates = cube.groups([locations for _, locations in groups] + [[competitor] for competitor in competitors], period)
+    group_aggregates = {name: aggregate for (name, _), aggregate in zip(groups, aggregates)}
+    competitor_groups = dict(zip(competitors, aggregates[len(groups):]))
+    # An empty aggregate stands in for the total when nothing is compared
+    total = GroupAggregate.combine(aggregates or cube.groups([[]], period))
+    return Selection(group_aggregates, competitor_groups, total, cube.period_quarters(period))
+
+
+def normalize_locations(names):
+    # Cache key part for a location selection: the order of the picks doesn't matter
+    return tuple(sorted(set(names or [])))
+
+
+def normalize_groups(names, locations, competitors):
+    # Cache key part for the comparison groups, ((name, locations), ...) in the order of the
+    # group boxes. Names become table columns and chart series, so they are made unique,
+    # also against the competitors, the fixed columns and the hidden colouring columns.
+    taken = {'Topic', 'Total'} | set(competitors or [])
+    groups = []
+    for i, (name, picks) in enumerate(zip(names, locations)):
+        name = (name or '').strip() or default_group_name(i)
+        unique, n = name, 2
+        while unique in taken or HIDDEN_COLUMN_ID.fullmatch(unique):
+            unique, n = f'{name} ({n})', n + 1
+        taken.add(unique)
+        groups.append((unique, normalize_locations(picks)))
+    return tuple(groups)
+
+
+def normalize_period(start_date, end_date):
+    # Cache key part for the period filter: (first_day, last_day), or None when it covers
+    # all reviews, so the unfiltered panels keep using the plain cube cells
+    summary = reviews.summary()
+    if summary.first_day is None:
+        return None
+    first_day = to_day(start_date) if start_date else summary.first_day
+    last_day = to_day(end_date) if end_date else summary.last_day
+    if first_day <= summary.first_day and last_day >= summary.last_day:
+        return None
+    return first_day, last_day
+
+
+def get_selection(groups, competitors, period):
+    return _build_selection(groups, normalize_locations(competitors), period)
+
+
+def table_groups(selection):
+    # Groups with a column in the tables: the first one always, the others once they have reviews
+    return [name for i, (name, group) in enumerate(selection.groups.items()) if i == 0 or not group.empty]
+
+
+def compared_groups(selection, competitors):
+    # Table columns after Total: the groups, then the competitors in the order they were picked
+    compared = {name: selection.groups[name] for name in table_groups(selection)}
+    compared.update((competitor, selection.competitor_groups[competitor]) for competitor in competitors)
+    return compared
+
+
+GROUP_COLORS = ['#b22122', '#141F52', '#7B3F98', '#2E7D32', '#8C6D46', '#00838F']
+
+
+def selection_colors(group_names, competitors):
+    colors = {name: GROUP_COLORS[idx % len(GROUP_COLORS)] for idx, name in enumerate(group_names)}
     color_list = ['#1DC9A4', '#F97A1F', '#1A1A1A', '#F9C31F', '#E1DFD0']
-    if not main_data1.empty:
-        average_ratings['Selektion A'] = round(main_data1['Rating'].mean(), 1)
-    if not main_data2.empty:
-        average_ratings['Selektion B'] = round(main_data2['Rating'].mean(), 1)
     for idx, competitor in enumerate(competitors):
-        competitor_avg_rating = round(filtered_data[filtered_data['name'] == competitor]['Rating'].mean(), 1)
-        average_ratings[competitor] = competitor_avg_rating
         colors[competitor] = color_list[idx % len(color_list)]
+    return colors
 
-    # Reverse the order of the selections for the bar chart
-    average_ratings = dict(reversed(list(average_ratings.items())))
-
-    # Prepare data for the horizontal bar chart
-    bar_chart = go.Figure()
-    bar_chart.add_trace(go.Bar(
-        x=list(average_ratings.values()),
-        y=list(average_ratings.keys()),
-        orientation='h',
-        marker=dict(color=[colors[key] for key in average_ratings.keys()]),
-        text=list(average_ratings.values()),  # Display the average rating on the bars
-        textposition='auto'
-    ))
-
-    bar_chart.update_layout(
-        font=dict(family='Roboto Condensed, sans-serif', size=14),
-        xaxis=dict(
-            title='Durchschnittliches Rating',
-            range=[1, 5]
-        ),
-        yaxis=dict(
-            title='',
-            tickfont=dict(size=16),  # Increase the y-axis labels' font size
-            automargin=True,  # Automatically adjust the margins to prevent label overlap
-            ticklabelposition='outside',  # Move the tick labels to the outside of the axis
-            ticks='outside',
-            ticklen=20  # Add extra length to the ticks to create space
-        ),
-        margin=dict(l=20, r=20, t=20, b=40),  # Adjust left margin to provide space for y-axis labels
-        plot_bgcolor='white',  # Set background color to white
-        xaxis_showgrid=False,  # Remove grid lines
-        yaxis_showgrid=False   # Remove grid lines
-    )
-
-    # Ensure the text on the bars is updated with a larger font size
-    for trace in bar_chart.data:
-        trace.textfont = dict(size=18)
-
-    # Calculate the number of respondents
-    respondent_count = len(filtered_data)
-
-    # Create the line chart for overall satisfaction trend
-    traces_line = []
-    filtered_data['quarter'] = filtered_data['date'].dt.to_period('Q')
-    
-    # Ensure quarters are sorted in the correct order
-    quarters_order = pd.period_range(start='2018Q1', end='2024Q2', freq='Q')
-    filtered_data['quarter'] = pd.Categorical(filtered_data['quarter'], categories=quarters_order, ordered=True)
-    
-    window_size = 4  # Set the window size for the moving average
-    
-    # Plot the main standort 1 as a single line
-    if not main_data1.empty:
-        main_trend_data1 = main_data1.groupby('quarter', observed=True)['Rating'].mean().reindex(quarters_order).reset_index()
-        main_trend_data1.columns = ['quarter', 'Rating']  # Renaming columns after reindex
-        main_trend_data1['Rating'] = main_trend_data1['Rating'].interpolate(method='linear')  # Interpolating missing values
-        main_trend_data1['Moving_Avg'] = main_trend_data1['Rating'].rolling(window=window_size, min_periods=1).mean()  # Calculate the moving average
-        traces_line.append(go.Scatter(
-            x=main_trend_data1['quarter'].astype(str),
-            y=main_trend_data1['Moving_Avg'],
-            mode='lines+markers',
-            line_shape='spline',
-            name='Selektion A',
-            line=dict(color=colors['Selektion A'])
-        ))
 
-    # Plot the main standort 2 as a single line
-    if not main_data2.empty:
-        main_trend_data2 = main_data2.groupby('quarter', observed=True)['Rating'].mean().reindex(quarters_order).reset_index()
-        main_trend_data2.columns = ['quarter', 'Rating']  # Renaming columns after reindex
-        main_trend_data2['Rating'] = main_trend_data2['Rating'].interpolate(method='linear')  # Interpolating missing values
-        main_trend_data2['Moving_Avg'] = main_trend_data2['Rating'].rolling(window=window_size, min_periods=1).mean()  # Calculate the moving average
-        traces_line.append(go.Scatter(
-            x=main_trend_data2['quarter'].astype(str),
-            y=main_trend_data2['Moving_Avg'],
-            mode='lines+markers',
-            line_shape='spline',
-            name='Selektion B',
-            line=dict(color=colors['Selektion B'])
-        ))
+# Ids of the hidden diff/sig columns (below), never used for a group
+HIDDEN_COLUMN_ID = re.compile(r'(diff|sig)\d+')
+
+
+def difference_column(i):
+    # Short positional ids, since the key is repeated in every row
+    return f'diff{i}'
+
+
+def add_difference_columns(rows, columns, compared, digits):
+    # Store each value's difference to Total in a hidden column, so the colouring
+    # needs two style rules per column no matter how many rows there are
+    for row in rows:
+        total = to_number(row['Total'])
+        for i, standort in enumerate(compared):
+            value = to_number(row.get(standort))
+            row[difference_column(i)] = round(value - total, digits) if value is not None and total is not None else None
+    columns += [{'name': '', 'id': difference_column(i)} for i in range(len(compared))]
+
+
+def significance_column(i):
+    return f'sig{i}'
+
+
+def add_significance_columns(rows, columns, signs, order):
+    # +1/-1/0 per compared cell in a hidden column: significantly above/below the rest of
+    # the comparison or not. `signs` is a (groups, topics) Significance matrix, Total first,
+    # and the rows are its topics in `order`.
+    for row, t in zip(rows, order):
+        for i in range(len(signs) - 1):
+            row[significance_column(i)] = int(signs[i + 1, t])
+    columns += [{'name': '', 'id': significance_column(i)} for i in range(len(signs) - 1)]
+
+
+def hidden_colouring_columns(compared):
+    return [difference_column(i) for i in range(len(compared))] + [significance_column(i) for i in range(len(compared))]
 
-    # Plot competitors as separate lines
-    for i, name in enumerate(competitors):
-        name_data = filtered_data[filtered_data['name'] == name]
-        trend_data = name_data.groupby('quarter', observed=True)['Rating'].mean().reindex(quarters_order).reset_index()
-        trend_data.columns = ['quarter', 'Rating']  # Renaming columns after reindex
-        trend_data['Rating'] = trend_data['Rating'].interpolate(method='linear')  # Interpolating missing values
-        trend_data['Moving_Avg'] = trend_data['Rating'].rolling(window=window_size, min_periods=1).mean()  # Calculate the moving average
-        traces_line.append(go.Scatter(
-            x=trend_data['quarter'].astype(str),
-            y=trend_data['Moving_Avg'],
-            mode='lines+markers',
-            line_shape='spline',
-            name=name,
-            line=dict(color=colors[name])
+
+def to_number(value):
+    # Cell values are numbers (heatmap) or strings like '4.5 *' / 'N/A' (rating table)
+    if isinstance(value, str):
+        value = value.rstrip(' *')
+        return None if value == 'N/A' else float(value)
+    return value
+
+
+# Both topic tables are read off one group x topic matrix per comparison (Total first,
+# then the groups and competitors), instead of looking up every (topic, group) cell
+@result_cache.memoize
+def _topic_matrix(groups, competitors, period):
+    selection = get_selection(groups, competitors, period)
+    return topic_matrix({'Total': selection.filtered_data, **compared_groups(selection, list(competitors))})
+
+
+# The significance tests run on the same matrix and are cached along with it. Set
+# SIGNIFICANCE_BOOTSTRAP=<resamples> to decide by bootstrap intervals instead (about
+# 0.25s per 200 resamples for 60 columns, once per comparison).
+SIGNIFICANCE_RESAMPLES = int(os.environ.get('SIGNIFICANCE_BOOTSTRAP', 0))
+
+
+@result_cache.memoize
+def _significance(groups, competitors, period):
+    return significance(_topic_matrix(groups, competitors, period), SIGNIFICANCE_RESAMPLES)
+
+
+def build_topic_data(matrix):
+    # Create the data for the topic heatmap/datatable
+    shares = np.round(matrix.share, 1)
+    topic_data = []
+    for t in topic_order(matrix):
+        row = {'Topic': topics[t]}
+        for g, name in enumerate(matrix.names):
+            row[name] = shares[g, t] if matrix.total[g] > 0 else 0
+        topic_data.append(row)
+
+    # Define the columns for the DataTable
+    columns = [{'name': 'Topic', 'id': 'Topic'}] + [{'name': name, 'id': name} for name in matrix.names]
+
+    # Every cell of a column is based on the same number of reviews, so one tooltip per column is enough
+    topic_tooltip_data = {
+        name: {'value': f"Basiert auf {total} Freitexten.", 'use_with': 'data'}
+        for name, total in zip(matrix.names, matrix.total)
+    }
+
+    return topic_data, topic_tooltip_data, columns
+
+
+@app.callback(
+    [Output('average-satisfaction-bar', 'figure'),
+     Output('respondent-count', 'children'),
+     Output('satisfaction-trend', 'figure')],
+    COMPARISON_INPUTS
+)
+@metrics.timed('comparison_charts')
+def update_comparison_charts(group_names, group_locations, competitors, start_date, end_date):
+    return comparison_charts(normalize_groups(group_names, group_locations, competitors), tuple(competitors or []),
+                             normalize_period(start_date, end_date))
+
+
+# Competitor order decides colours and column order, so it stays part of the key of the panel results
+@result_cache.memoize
+def comparison_charts(groups, competitors, period):
+    competitors = list(competitors)
+    with metrics.stage('comparison_charts', 'select'):
+        selection = get_selection(groups, competitors, period)
+        filtered_data = selection.filtered_data
+
+    with metrics.stage('comparison_charts', 'aggregate'):
+        # Groups with reviews and all competitors, each with its average satisfaction
+        shown = {name: group for name, group in selection.groups.items() if not group.empty}
+        shown.update((competitor, selection.competitor_groups[competitor]) for competitor in competitors)
+        colors = selection_colors(list(selection.groups), competitors)
+        average_ratings = {name: round(group.mean_rating, 1) for name, group in shown.items()}
+
+        # Reverse the order of the selections for the bar chart
+        average_ratings = dict(reversed(list(average_ratings.items())))
+
+        window_size = 4  # Set the window size for the moving average
+
+        # Groups and competitors as columns of one quarter x series frame,
+        # over the quarters the data actually covers
+        trend = moving_average_trend(
+            pd.DataFrame({name: group.quarterly_mean_rating() for name, group in shown.items()},
+                         index=selection.quarters, columns=list(shown)),
+            window_size
+        )
+        quarter_labels = trend.index.astype(str)
+
+    with metrics.stage('comparison_charts', 'figure'):
+        # Prepare data for the horizontal bar chart
+        bar_chart = go.Figure()
+        bar_chart.add_trace(go.Bar(
+            x=list(average_ratings.values()),
+            y=list(average_ratings.keys()),
+            orientation='h',
+            marker=dict(color=[colors[key] for key in average_ratings.keys()]),
+            text=list(average_ratings.values()),  # Display the average rating on the bars
+            textposition='auto'
         ))
 
-    figure_line = {
-        'data': traces_line,
-        'layout': go.Layout(
+        bar_chart.update_layout(
             font=dict(family='Roboto Condensed, sans-serif', size=14),
-            yaxis={
-                'title': 'Durchschnittliches Rating',
-                'range': [1, 5],
-                'tickmode': 'array',
-                'tickvals': [1, 2, 3, 4, 5]
-            },
-            xaxis={
-                'title': {
-                    'text': 'Quartal',
-                    'standoff': 30  # Add this line to create space between the x-axis title and the x-ticks labels
-                },
-                'tickangle': 90
-            },
-            legend=dict(
-                orientation="h",  # This makes the legend horizontal
-                x=0.5,            # Position the legend in the center
-                y=1.15,           # Position the legend above the chart
-                xanchor='center', # Anchor the center of the legend box to the x coordinate
-                yanchor='bottom', # Anchor the bottom of the legend box to the y coordinate
-                font=dict(
-                    size=15        # Increase the font size of the legend
-                )
+            xaxis=dict(
+                title='Durchschnittliches Rating',
+                range=[1, 5]
             ),
-            margin=dict(
-                l=50, r=20, t=60, b=100  # Adjust margins to provide space for the y-axis labels and the legend
+            yaxis=dict(
+                title='',
+                tickfont=dict(size=16),  # Increase the y-axis labels' font size
+                automargin=True,  # Automatically adjust the margins to prevent label overlap
+                ticklabelposition='outside',  # Move the tick labels to the outside of the axis
+                ticks='outside',
+                ticklen=20  # Add extra length to the ticks to create space
             ),
+            margin=dict(l=20, r=20, t=20, b=40),  # Adjust left margin to provide space for y-axis labels
+            plot_bgcolor='white',  # Set background color to white
+            xaxis_showgrid=False,  # Remove grid lines
+            yaxis_showgrid=False   # Remove grid lines
         )
-    }
-    
-    # Create the data for the topic heatmap/datatable
-    topic_data = []
-    topic_tooltip_data = []
-    for topic in topics:
-        row = {'Topic': topic}
-        tooltip_row = {'Topic': topic}
-        total_count = filtered_data[topic].sum()
-        overall_total = len(filtered_data)
-        row['Total'] = round((total_count / overall_total * 100), 1) if overall_total > 0 else 0
-        tooltip_row['Total'] = f"Basiert auf {overall_total} Freitexten."
-        main_count1 = main_data1[topic].sum()
-        main_total1 = len(main_data1)
-        row['Selektion A'] = round((main_count1 / main_total1 * 100), 1) if main_total1 > 0 else 0
-        tooltip_row['Selektion A'] = f"Basiert auf {main_total1} Freitexten."
-        if not main_data2.empty:
-            main_count2 = main_data2[topic].sum()
-            main_total2 = len(main_data2)
-            row['Selektion B'] = round((main_count2 / main_total2 * 100), 1) if main_total2 > 0 else 0
-            tooltip_row['Selektion B'] = f"Basiert auf {main_total2} Freitexten."
-        for standort in competitors:
-            count = filtered_data[filtered_data['name'] == standort][topic].sum()
-            total = len(filtered_data[filtered_data['name'] == standort])
-            row[standort] = round((count / total * 100), 1) if total > 0 else 0
-            tooltip_row[standort] = f"Basiert auf {total} Freitexten."
-        topic_data.append(row)
-        topic_tooltip_data.append(tooltip_row)
-    
-    # Define the columns for the DataTable
-    columns = [{'name': 'Topic', 'id': 'Topic'}, {'name': 'Total', 'id': 'Total'}, {'name': 'Selektion A', 'id': 'Selektion A'}]
-    if not main_data2.empty:
-        columns.append({'name': 'Selektion B', 'id': 'Selektion B'})
-    columns += [{'name': name, 'id': name} for name in competitors]
-    
-    # Sort topic_data by 'Total' column in descending order
-    topic_data = sorted(topic_data, key=lambda x: x['Total'], reverse=True)
-    topic_tooltip_data = sorted(topic_tooltip_data, key=lambda x: x['Total'], reverse=True)
-    
-    # Create style_data_conditional for conditional formatting
-    style_data_conditional = []
-    for i, row in enumerate(topic_data):
-        total_value = row['Total']
-        row_styles = {
-            'if': {'row_index': i},
-            'backgroundColor': '#F5F4EF' if i % 2 == 1 else 'white'
-        }
-        style_data_conditional.append(row_styles)
-        for standort in competitors + ['Selektion A', 'Selektion B']:
-            if standort in row:
-                if row[standort] > total_value + threshold:
-                    style_data_conditional.append({
-                        'if': {
-                            'filter_query': '{{{}}} = {}'.format(standort, row[standort]),
-                            'column_id': standort,
-                            'row_index': i
-                        },
-                        'backgroundColor': 'green',
-                        'color': 'white'
-                    })
-                elif row[standort] < total_value - threshold:
-                    style_data_conditional.append({
-                        'if': {
-                            'filter_query': '{{{}}} = {}'.format(standort, row[standort]),
-                            'column_id': standort,
-                            'row_index': i
-                        },
-                        'backgroundColor': 'red',
-                        'color': 'white'
-                    })
-
-    # Calculate the average rating per topic and location
-    average_rating_data = []
-    average_rating_tooltip_data = []
-    has_asterisk = False
-    for topic in topics:
-        row = {'Topic': topic}
-        tooltip_row = {'Topic': topic}
-        total_avg_rating = filtered_data[filtered_data[topic] == 1]['Rating'].mean()
-        total_count = len(filtered_data[filtered_data[topic] == 1])
-        row['Total'] = str(round(total_avg_rating, 1)) if not np.isnan(total_avg_rating) else 'N/A'
-        tooltip_row['Total'] = f"Basiert auf {total_count} Freitexten."
-        main_avg_rating1 = main_data1[main_data1[topic] == 1]['Rating'].mean()
-        main_count1 = len(main_data1[main_data1[topic] == 1])
-        row['Selektion A'] = str(round(main_avg_rating1, 1)) if not np.isnan(main_avg_rating1) else 'N/A'
-        if main_count1 < 15 and main_count1 > 0:
-            row['Selektion A'] += ' *'
-            has_asterisk = True
-        tooltip_row['Selektion A'] = f"Basiert auf {main_count1} Freitexten."
-        if not main_data2.empty:
-            main_avg_rating2 = main_data2[main_data2[topic] == 1]['Rating'].mean()
-            main_count2 = len(main_data2[main_data2[topic] == 1])
-            row['Selektion B'] = str(round(main_avg_rating2, 1)) if not np.isnan(main_avg_rating2) else 'N/A'
-            if main_count2 < 15 and main_count2 > 0:
-                row['Selektion B'] += ' *'
-                has_asterisk = True
-            tooltip_row['Selektion B'] = f"Basiert auf {main_count2} Freitexten."
-        for standort in competitors:
-            filtered_reviews = filtered_data[(filtered_data['name'] == standort) & (filtered_data[topic] == 1)]
-            avg_rating = filtered_reviews['Rating'].mean()
-            count = len(filtered_reviews)
-            if not np.isnan(avg_rating):
-                row[standort] = str(round(avg_rating, 1)) + (' *' if count < 15 and count > 0 else '')
-                if count < 15 and count > 0:
-                    has_asterisk = True
-            else:
-                row[standort] = 'N/A'
-            tooltip_row[standort] = f"Basiert auf {count} Freitexten."
-        average_rating_data.append(row)
-        average_rating_tooltip_data.append(tooltip_row)
-    
-    # Define the columns for the average rating DataTable
-    average_rating_columns = [{'name': 'Topic', 'id': 'Topic'}, {'name': 'Total', 'id': 'Total'}, {'name': 'Selektion A', 'id': 'Selektion A'}]
-    if not main_data2.empty:
-        average_rating_columns.append({'name': 'Selektion B', 'id': 'Selektion B'})
-    average_rating_columns += [{'name': name, 'id': name} for name in competitors]
-
-    # Ensure that average_rating_data follows the same order as topic_data
-    topic_order = [row['Topic'] for row in topic_data]
-    average_rating_data = sorted(average_rating_data, key=lambda x: topic_order.index(x['Topic']))
-    average_rating_tooltip_data = sorted(average_rating_tooltip_data, key=lambda x: topic_order.index(x['Topic']))
-
-    # Create style_data_conditional for conditional formatting for average rating table
-    rating_style_data_conditional = []
-    for i, row in enumerate(average_rating_data):
-        total_value = row['Total']
-        row_styles = {
-            'if': {'row_index': i},
-            'backgroundColor': '#F5F4EF' if i % 2 == 1 else 'white'
+
+        # Ensure the text on the bars is updated with a larger font size
+        for trace in bar_chart.data:
+            trace.textfont = dict(size=18)
+
+        # Calculate the number of respondents
+        respondent_count = filtered_data.count
+
+        # Create the line chart for overall satisfaction trend
+        traces_line = []
+
+        # Plot the selections and competitors as separate lines
+        for name in trend.columns:
+            traces_line.append(go.Scatter(
+                x=quarter_labels,
+                y=trend[name].round(3),  # three decimals are plenty for a 1-5 scale and keep the JSON small
+                mode='lines+markers',
+                line_shape='spline',
+                name=name,
+                line=dict(color=colors[name])
+            ))
+
+        figure_line = {
+            'data': traces_line,
+            'layout': go.Layout(
+                font=dict(family='Roboto Condensed, sans-serif', size=14),
+                yaxis={
+                    'title': 'Durchschnittliches Rating',
+                    'range': [1, 5],
+                    'tickmode': 'array',
+                    'tickvals': [1, 2, 3, 4, 5]
+                },
+                xaxis={
+                    'title': {
+                        'text': 'Quartal',
+                        'standoff': 30  # Add this line to create space between the x-axis title and the x-ticks labels
+                    },
+                    'tickangle': 90
+                },
+                legend=dict(
+                    orientation="h",  # This makes the legend horizontal
+                    x=0.5,            # Position the legend in the center
+                    y=1.15,           # Position the legend above the chart
+                    xanchor='center', # Anchor the center of the legend box to the x coordinate
+                    yanchor='bottom', # Anchor the bottom of the legend box to the y coordinate
+                    font=dict(
+                        size=15        # Increase the font size of the legend
+                    )
+                ),
+                margin=dict(
+                    l=50, r=20, t=60, b=100  # Adjust margins to provide space for the y-axis labels and the legend
+                ),
+            )
         }
-        rating_style_data_conditional.append(row_styles)
-        for standort in competitors + ['Selektion A', 'Selektion B']:
-            if standort in row and row[standort] != 'N/A':
-                # Check if value contains an asterisk
-                value_with_star = row[standort]
-                if ' *' in value_with_star:
-                    # Remove the asterisk for comparison and extract the numeric part
-                    value = float(value_with_star.replace(' *', ''))
-                    rating_style_data_conditional.append({
-                        'if': {
-                            'filter_query': '{{{}}} = "{}"'.format(standort, value_with_star),
-                            'column_id': standort,
-                            'row_index': i
-                        },
-                        'color': 'grey'
-                    })
-                else:
-                    value = float(value_with_star)
-                if value > float(total_value) + rating_threshold:
-                    rating_style_data_conditional.append({
-                        'if': {
-                            'filter_query': '{{{}}} = "{}"'.format(standort, value_with_star),
-                            'column_id': standort,
-                            'row_index': i
-                        },
-                        'backgroundColor': 'green',
-                        'color': 'white'
-                    })
-                elif value < float(total_value) - rating_threshold:
-                    rating_style_data_conditional.append({
-                        'if': {
-                            'filter_query': '{{{}}} = "{}"'.format(standort, value_with_star),
-                            'column_id': standort,
-                            'row_index': i
-                        },
-                        'backgroundColor': 'red',
-                        'color': 'white'
-                    })
-    
-    # Filter reviews based on the user's selection
-    reviews_filtered = data[
-        (data['name'] == selected_standort) &
-        (data['date'] >= pd.to_datetime(start_date)) &
-        (data['date'] <= pd.to_datetime(end_date)) &
-        (data[selected_topic] == 1) &
-        (data['Rating'] >= review_rating[0]) &
-        (data['Rating'] <= review_rating[1])
-    ]
 
-    if search_term:
-        reviews_filtered = reviews_filtered[reviews_filtered['Review'].str.contains(search_term, case=False, na=False)]
-    
-    # Create the data for the filtered reviews table
-    reviews_data = reviews_filtered[['date', 'Review', 'Rating', selected_topic]].to_dict('records')
-    
-    # Define the columns for the filtered reviews table
+    return bar_chart, str(respondent_count), figure_line
+
+
+@app.callback(
+    [Output('topic-heatmap', 'data'),
+     Output('topic-heatmap', 'columns'),
+     Output('topic-heatmap', 'hidden_columns'),
+     Output('topic-heatmap', 'tooltip')],
+    COMPARISON_INPUTS
+)
+@metrics.timed('topic_heatmap')
+def update_topic_heatmap(group_names, group_locations, competitors, start_date, end_date):
+    return topic_heatmap(normalize_groups(group_names, group_locations, competitors), tuple(competitors or []),
+                         normalize_period(start_date, end_date))
+
+
+# The sensitivity sliders and significance switches only change the colour rules, which are
+# built in the browser (assets/table_colouring.js) from the hidden difference-to-Total and
+# significance columns
+app.clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='heatmapStyles'),
+    Output('topic-heatmap', 'style_data_conditional'),
+    Input('threshold-slider', 'value'),
+    Input('threshold-significance', 'value'),
+    Input('topic-heatmap', 'columns'),
+    Input('topic-heatmap', 'hidden_columns')
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='ratingStyles'),
+    Output('average-rating-table', 'style_data_conditional'),
+    Input('rating-threshold-slider', 'value'),
+    Input('rating-threshold-significance', 'value'),
+    Input('average-rating-table', 'columns'),
+    Input('average-rating-table', 'hidden_columns')
+)
+
+
+@result_cache.memoize
+def topic_heatmap(groups, competitors, period):
+    with metrics.stage('topic_heatmap', 'select'):
+        matrix = _topic_matrix(groups, competitors, period)
+    with metrics.stage('topic_heatmap', 'significance'):
+        signs = _significance(groups, competitors, period).share
+    with metrics.stage('topic_heatmap', 'table'):
+        topic_data, topic_tooltip_data, columns = build_topic_data(matrix)
+
+        # Cells are coloured through the hidden difference-to-Total and significance
+        # columns: a few rules per column instead of one filter_query rule per coloured cell
+        compared = [col['id'] for col in columns[2:]]
+        add_difference_columns(topic_data, columns, compared, digits=1)
+        add_significance_columns(topic_data, columns, signs, topic_order(matrix))
+    return topic_data, columns, hidden_colouring_columns(compared), topic_tooltip_data
+
+
+@app.callback(
+    [Output('average-rating-table', 'data'),
+     Output('average-rating-table', 'columns'),
+     Output('average-rating-table', 'hidden_columns'),
+     Output('average-rating-table', 'tooltip_data'),
+     Output('asterisk-explanation', 'children')],
+    COMPARISON_INPUTS
+)
+@metrics.timed('average_rating_table')
+def update_average_rating_table(group_names, group_locations, competitors, start_date, end_date):
+    return average_rating_table(normalize_groups(group_names, group_locations, competitors), tuple(competitors or []),
+                                normalize_period(start_date, end_date))
+
+
+@result_cache.memoize
+def average_rating_table(groups, competitors, period):
+    with metrics.stage('average_rating_table', 'select'):
+        matrix = _topic_matrix(groups, competitors, period)
+    with metrics.stage('average_rating_table', 'significance'):
+        signs = _significance(groups, competitors, period).rating
+    with metrics.stage('average_rating_table', 'table'):
+        # Values on fewer than 15 reviews get an asterisk, except in the Total column
+        mean_ratings = np.round(matrix.mean_rating, 1)
+        small_bases = (matrix.count > 0) & (matrix.count < 15)
+        small_bases[0] = False
+        has_asterisk = bool(small_bases.any())
+
+        # Calculate the average rating per topic and location, in the order of the heatmap
+        average_rating_data = []
+        average_rating_tooltip_data = []
+        for t in topic_order(matrix):
+            row = {'Topic': topics[t]}
+            tooltip_row = {}
+            for g, name in enumerate(matrix.names):
+                row[name] = str(mean_ratings[g, t]) if not np.isnan(mean_ratings[g, t]) else 'N/A'
+                if small_bases[g, t]:
+                    row[name] += ' *'
+                tooltip_row[name] = f"Basiert auf {matrix.count[g, t]} Freitexten."
+            average_rating_data.append(row)
+            average_rating_tooltip_data.append(tooltip_row)
+
+        # Define the columns for the average rating DataTable
+        average_rating_columns = [{'name': 'Topic', 'id': 'Topic'}] + [{'name': name, 'id': name} for name in matrix.names]
+
+        # Cells are coloured through the hidden difference-to-Total columns, small bases are greyed per column
+        compared = [col['id'] for col in average_rating_columns[2:]]
+        add_difference_columns(average_rating_data, average_rating_columns, compared, digits=2)
+        add_significance_columns(average_rating_data, average_rating_columns, signs, topic_order(matrix))
+
+        asterisk_explanation = "* bedeutet, dass diese Werte auf kleinen Basen beruhen." if has_asterisk else ""
+
+    return average_rating_data, average_rating_columns, hidden_colouring_columns(compared), average_rating_tooltip_data, asterisk_explanation
+
+
+# The review table only depends on the deep-dive filters, never on the comparison aggregates
+@app.callback(
+    [Output('filtered-reviews-table', 'data'),
+     Output('filtered-reviews-table', 'columns'),
+     Output('filtered-reviews-table', 'page_count'),
+     Output('filtered-reviews-table', 'page_current'),
+     Output('filtered-reviews-count', 'children')],
+    [Input('topic-dropdown', 'value'),
+     Input('standort-dropdown', 'value'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date'),
+     Input('review-rating-slider', 'value'),
+     Input('search-term', 'value'),
+     Input('filtered-reviews-table', 'filter_query'),
+     Input('filtered-reviews-table', 'page_current'),
+     Input('filtered-reviews-table', 'page_size'),
+     Input('filtered-reviews-table', 'sort_by')]
+)
+@metrics.timed('reviews_table')
+def update_reviews_table(selected_topic, selected_standort, start_date, end_date, review_rating, search_term,
+                         filter_query, page_current, page_size, sort_by):
+    search_term = (search_term or '').strip()
+    filter_state = (selected_topic, selected_standort, start_date, end_date, review_rating[0], review_rating[1],
+                    search_term, filter_query or '')
+
+    # Any change other than flipping the page starts again at the first page
+    if 'filtered-reviews-table.page_current' not in dash.callback_context.triggered_prop_ids:
+        page_current = 0
+    page_size = page_size or REVIEWS_PAGE_SIZE
+
+    # Filter reviews based on the user's selection (cached per filter state)
+    review_table = reviews.current.review_table
+    with metrics.stage('reviews_table', 'filter'):
+        rows = review_table.filter_rows(*filter_state)
+    total = len(rows)
+    with metrics.stage('reviews_table', 'sort'):
+        page_rows = review_table.page(rows, sort_by, page_current, page_size)
+
+    # Create the data for the visible page of the filtered reviews table
+    with metrics.stage('reviews_table', 'table'):
+        reviews_data = review_table.records(page_rows, selected_topic, search_term)
+
+    # Define the columns for the filtered reviews table, search hits are rendered in bold
     reviews_columns = [{'name': col, 'id': col} for col in ['date', 'Review', 'Rating', selected_topic]]
-    
-    asterisk_explanation = "* bedeutet, dass diese Werte auf kleinen Basen beruhen." if has_asterisk else ""
-    
-    return (bar_chart, str(respondent_count), figure_line, topic_data, columns, style_data_conditional, topic_tooltip_data, 
-            average_rating_data, average_rating_columns, rating_style_data_conditional, average_rating_tooltip_data, reviews_data, reviews_columns, asterisk_explanation)
+    if search_term:
+        reviews_columns[1]['presentation'] = 'markdown'
+
+    page_count = max(1, -(-total // page_size))
+    return reviews_data, reviews_columns, page_count, page_current, f"{total} Freitexte gefunden."
+
 
 if __name__ == '__main__':
     app.run_server(debug=True)
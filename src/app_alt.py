@@ -4,11 +4,10 @@ from dash.dependencies import Input, Output
 import plotly.graph_objs as go
 import pandas as pd
 import numpy as np
+from dataset import load_dataset
 
-# Load the dataset
-data = pd.read_csv("google_reviews_test.csv")
-
-data['date'] = pd.to_datetime(data['date'])
+# Load the dataset (from the columnar snapshot when one was built for this CSV)
+data = load_dataset("google_reviews_test.csv").to_frame()
 
 # List of topics
 topics = ['Kundenservice', 'Beratung', 'Freundlichkeit', 'Fahrzeugübergabe', 'Zubehör', 'Werkstattservice', 'Preis-Leistungs-Verhältnis', 'Sauberkeit', 'Zuverlässigkeit', 'Terminvereinbarung', 'Lieferzeit', 'Garantieabwicklung', 'Reparaturqualität', 'Auswahl']
@@ -0,0 +1,67 @@
+// Cell colouring of the topic heatmap and the average rating table. The server sends
+// the values plus, in hidden columns (see app.py), each value's difference to Total
+// (diffN) and whether it differs significantly from the rest of the comparison (sigN:
+// 1, -1 or 0). The colour rules only depend on the sensitivity sliders and the
+// significance switches, so they are built here and changing them never goes to the server.
+(function () {
+    var STRIPED_ROWS = [
+        {'if': {'row_index': 'odd'}, 'backgroundColor': '#F5F4EF'},
+        {'if': {'row_index': 'even'}, 'backgroundColor': 'white'}
+    ];
+
+    // Selections and competitors, in the order of their diff0, diff1, ... columns
+    function compared(columns, hiddenColumns) {
+        var count = differenceColumns(hiddenColumns).length;
+        return (columns || []).slice(2, 2 + count).map(function (column) { return column.id; });
+    }
+
+    function differenceColumns(hiddenColumns) {
+        return (hiddenColumns || []).filter(function (id) { return id.indexOf('diff') === 0; });
+    }
+
+    // Green above Total + threshold, red below Total - threshold: two rules per column.
+    // With `significantOnly` the cell also has to differ significantly in that direction.
+    function thresholdStyles(standorte, threshold, significantOnly) {
+        var styles = [];
+        standorte.forEach(function (standort, i) {
+            var above = '{diff' + i + '} > ' + threshold;
+            var below = '{diff' + i + '} < ' + (-threshold);
+            if (significantOnly) {
+                above += ' && {sig' + i + '} > 0';
+                below += ' && {sig' + i + '} < 0';
+            }
+            styles.push({
+                'if': {'filter_query': above, 'column_id': standort},
+                'backgroundColor': 'green',
+                'color': 'white'
+            });
+            styles.push({
+                'if': {'filter_query': below, 'column_id': standort},
+                'backgroundColor': 'red',
+                'color': 'white'
+            });
+        });
+        return styles;
+    }
+
+    function isChecked(switchValue) {
+        return (switchValue || []).indexOf('significant') >= 0;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        tables: {
+            heatmapStyles: function (threshold, significance, columns, hiddenColumns) {
+                var standorte = compared(columns, hiddenColumns);
+                return STRIPED_ROWS.concat(thresholdStyles(standorte, threshold, isChecked(significance)));
+            },
+            // Values on small bases end in ' *' and are greyed
+            ratingStyles: function (threshold, significance, columns, hiddenColumns) {
+                var standorte = compared(columns, hiddenColumns);
+                var smallBases = standorte.map(function (standort) {
+                    return {'if': {'filter_query': '{' + standort + '} contains "*"', 'column_id': standort}, 'color': 'grey'};
+                });
+                return STRIPED_ROWS.concat(smallBases, thresholdStyles(standorte, threshold, isChecked(significance)));
+            }
+        }
+    });
+})();
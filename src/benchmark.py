@@ -0,0 +1,356 @@
+import argparse
+import collections
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+
+# Topic columns of the review exports and the share of reviews flagged with each,
+# as in the bundled data
+TOPIC_RATES = {
+    'Kundenservice': 0.305, 'Beratung': 0.404, 'Freundlichkeit': 0.445, 'Fahrzeugübergabe': 0.118,
+    'Zubehör': 0.147, 'Werkstattservice': 0.148, 'Preis-Leistungs-Verhältnis': 0.114, 'Sauberkeit': 0.054,
+    'Fahrzeugqualität': 0.112, 'Flexibilität': 0.055, 'Zuverlässigkeit': 0.177, 'Terminvereinbarung': 0.054,
+    'Lieferzeit': 0.05, 'Garantieabwicklung': 0.029, 'Reparaturqualität': 0.068, 'Auswahl': 0.402
+}
+RATING_SHARES = [0.079, 0.038, 0.061, 0.159, 0.663]
+
+WORDS = ('sehr gut freundlich kompetent Beratung Service Werkstatt Wohnmobil Wohnwagen Übergabe schnell '
+         'Termin Preis Zubehör Auswahl Team immer wieder gerne empfehlen leider lange Wartezeit Reparatur '
+         'Garantie sauber zuverlässig Lieferung Camping Vorzelt Mitarbeiter Chef top super nicht zufrieden '
+         'Kauf Fahrzeug Qualität flexibel unkompliziert Ersatzteile Hilfe Telefon erreichbar').split()
+
+# Comparisons to time: number of locations in each selection and number of competitors
+SCENARIOS = {
+    'one location': ((1, 0), 0),
+    '2 selections + 5 competitors': ((5, 5), 5),
+    '2 selections + 20 competitors': ((10, 10), 20),
+    '6 selections + 20 competitors': ((10, 10, 10, 5, 5, 5), 20),
+    '2 selections + 60 competitors': ((10, 10), 60)
+}
+
+
+def generate_reviews(n_rows, n_locations, seed=0):
+    # Synthetic reviews in the schema of the CSV exports. Location sizes follow a
+    # Zipf-like curve, so a few locations have many reviews and most have few.
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, n_locations + 1) ** 0.8
+    names = np.array([f'Standort {i:04d}' for i in range(n_locations)])[rng.choice(n_locations, n_rows, p=weights / weights.sum())]
+    first_day, last_day = np.datetime64('2013-04-01'), np.datetime64('2024-06-30')
+    days = first_day + rng.integers(0, (last_day - first_day).astype(int) + 1, n_rows)
+
+    lengths = np.minimum(rng.geometric(1 / 30, n_rows), 300)
+    words = np.array(WORDS, dtype=object)[rng.integers(0, len(WORDS), lengths.sum())]
+    ends = np.cumsum(lengths)
+    texts = [' '.join(words[end - length:end]) for end, length in zip(ends, lengths)]
+
+    frame = pd.DataFrame({'Review': texts})
+    for topic, rate in TOPIC_RATES.items():
+        frame[topic] = (rng.random(n_rows) < rate).astype(np.int64)
+    frame['date'] = pd.to_datetime(days).strftime('%Y-%m-%d')
+    frame['Rating'] = rng.choice(np.arange(1, 6), n_rows, p=RATING_SHARES)
+    frame['Num_Reviews'] = rng.integers(1, 200, n_rows)
+    frame['name'] = names
+    return frame
+
+
+def timed(func, repeats):
+    # Median wall time in ms over `repeats` calls, and the last result
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(times), 2), result
+
+
+def callback_payload(output, inputs, changed):
+    # Request body of /_dash-update-component, as dash-renderer sends it
+    outputs = [dict(zip(('id', 'property'), spec.rsplit('.', 1))) for spec in output.strip('.').split('...')]
+    return {
+        'output': output,
+        'outputs': outputs if len(outputs) > 1 else outputs[0],
+        # A pattern-matching input (a list of them) is sent as one entry per matched component
+        'inputs': [[input_entry(spec) for spec in item] if isinstance(item, list) else input_entry(item) for item in inputs],
+        'changedPropIds': changed,
+        'state': []
+    }
+
+
+def input_entry(spec):
+    (id, prop), value = spec
+    return {'id': id, 'property': prop, 'value': value}
+
+
+def scenario_locations(scenario):
+    sizes, n_competitors = SCENARIOS[scenario]
+    return sum(sizes) + n_competitors
+
+
+def pick_locations(app, dataset, scenario, seed=0):
+    # The largest locations in random order, so every group has reviews. Returns the
+    # groups as the callbacks normalize them, ((name, locations), ...), and the competitors.
+    sizes, n_competitors = SCENARIOS[scenario]
+    if scenario_locations(scenario) > len(dataset.locations):
+        raise ValueError(f'{scenario} needs {scenario_locations(scenario)} locations, the data has {len(dataset.locations)}')
+    largest = dataset.locations[np.argsort(-np.bincount(dataset.name_codes, minlength=len(dataset.locations)))]
+    names = list(np.random.default_rng(seed).permutation(largest[:sum(sizes) + n_competitors]))
+    ends = np.cumsum(sizes)
+    groups = [names[end - size:end] for end, size in zip(ends, sizes)]
+    competitors = tuple(names[sum(sizes):])
+    names = [app.default_group_name(i) for i in range(len(groups))]
+    return app.normalize_groups(names, groups, competitors), competitors
+
+
+def run_scenario(app, scenario, repeats):
+    # Per-stage and end-to-end callback timings of one comparison on the currently loaded data
+    store = app.reviews.current
+    cache = app.result_cache
+    groups, competitors = pick_locations(app, store.data, scenario)
+    standort = groups[0][1][0]
+    start = str(pd.Timestamp(app.days_to_datetime(store.data.days.min())).date())
+    end = str(pd.Timestamp(app.days_to_datetime(store.data.days.max())).date())
+    filter_state = ('Beratung', standort, start, end, 1, 5, 'freundlich', '')
+    # The last year, so the partial quarters at both ends are rebinned from the reviews
+    last_day = int(store.data.days.max())
+    period = (last_day - 364, last_day)
+    timings = {}
+
+    # Stages with an empty cache, in the order a page update runs them; later stages
+    # reuse the memoized selection like the real callbacks do
+    def stages():
+        cache.invalidate()
+        result = {}
+        for name, func in [
+            ('filter: selection', lambda: app._build_selection(groups, competitors, None)),
+            ('aggregate: topic matrix', lambda: app._topic_matrix(groups, competitors, None)),
+            ('filter: selection, last year', lambda: app._build_selection(groups, competitors, period)),
+            ('aggregate: heatmap', lambda: app.topic_heatmap(groups, competitors, None)),
+            ('aggregate: rating table', lambda: app.average_rating_table(groups, competitors, None)),
+            ('figure: comparison charts', lambda: app.comparison_charts(groups, competitors, None)),
+            ('filter: review rows', lambda: store.review_table.filter_rows(*filter_state)),
+            ('figure: review page', lambda: store.review_table.records(store.review_table.page(result['filter: review rows'], [], 0, 20), 'Beratung', 'freundlich')),
+        ]:
+            started = time.perf_counter()
+            result[name] = func()
+            timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        for name in ('aggregate: heatmap', 'aggregate: rating table', 'figure: comparison charts', 'figure: review page'):
+            to_json_plotly(result[name])
+        timings.setdefault('serialize: outputs', []).append((time.perf_counter() - started) * 1000)
+
+    for _ in range(repeats):
+        stages()
+    results = {name: round(statistics.median(values), 2) for name, values in timings.items()}
+
+    # End to end through the Dash endpoint, with an empty and with a warm result cache
+    client = app.server.test_client()
+    selection_inputs = [[(({'type': 'group-name', 'index': i}, 'value'), name) for i, (name, _) in enumerate(groups)],
+                        [(({'type': 'group-filter', 'index': i}, 'value'), list(locations)) for i, (_, locations) in enumerate(groups)],
+                        (('competitor-filter', 'value'), list(competitors)),
+                        (('period-filter', 'start_date'), start), (('period-filter', 'end_date'), end)]
+    requests = {
+        'update_comparison_charts': (selection_inputs, 'competitor-filter.value'),
+        'update_topic_heatmap': (selection_inputs, 'competitor-filter.value'),
+        'update_average_rating_table': (selection_inputs, 'competitor-filter.value'),
+        'update_reviews_table': ([(('topic-dropdown', 'value'), 'Beratung'), (('standort-dropdown', 'value'), standort),
+                                  (('date-picker-range', 'start_date'), start), (('date-picker-range', 'end_date'), end),
+                                  (('review-rating-slider', 'value'), [1, 5]), (('search-term', 'value'), 'freundlich'),
+                                  (('filtered-reviews-table', 'filter_query'), ''), (('filtered-reviews-table', 'page_current'), 0),
+                                  (('filtered-reviews-table', 'page_size'), 20), (('filtered-reviews-table', 'sort_by'), [])],
+                                 'search-term.value')
+    }
+    for output, callback in app.app.callback_map.items():
+        # Clientside callbacks have no Python function
+        name = getattr(callback.get('callback'), '__name__', None)
+        if name not in requests:
+            continue
+        inputs, changed = requests[name]
+        body = callback_payload(output, inputs, [changed])
+
+        def post():
+            response = client.post('/_dash-update-component', json=body)
+            assert response.status_code == 200, (name, response.status_code)
+            return len(response.data)
+
+        cold = []
+        for _ in range(repeats):
+            cache.invalidate()
+            cold.append(timed(post, 1)[0])
+        results[f'callback: {name}'] = round(statistics.median(cold), 2)
+        results[f'callback: {name} (cached)'], size = timed(post, repeats)
+        results[f'response bytes: {name}'] = size
+    return results
+
+
+def run_chat(base_url, messages):
+    # Round trips and time to first token of the chat path, against openai_stub.py
+    from openai import OpenAI
+    from chat import stream_reply
+    client = OpenAI(api_key='benchmark', base_url=base_url)
+    session = {'thread_id': None, 'run_id': None, 'run_status': None, 'messages': 0}
+    first_tokens, totals = [], []
+    for i in range(messages):
+        started = time.perf_counter()
+        first_token = None
+        for _ in stream_reply(client, 'asst_benchmark', session, f'Frage {i + 1}'):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+        totals.append((time.perf_counter() - started) * 1000)
+        first_tokens.append((first_token or 0) * 1000)
+    return {'chat: first token': round(statistics.median(first_tokens), 2), 'chat: total': round(statistics.median(totals), 2)}
+
+
+def run_tagging(n_rows, processes):
+    # Keyword tagging of a synthetic export without topic columns, streamed through
+    # tagging.tag_csv: ms per 1000 reviews (lower is better, as for all other timings)
+    import tempfile
+    from tagging import tag_csv
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path, out = os.path.join(tmp, 'reviews.csv'), os.path.join(tmp, 'tagged.csv')
+        generate_reviews(n_rows, 50).drop(columns=list(TOPIC_RATES)).to_csv(path, index=False)
+        for count in processes:
+            ms, _ = timed(lambda: tag_csv(path, out, count), 1)
+            timings[f'tagging: {count} processes, per 1000 reviews'] = round(ms * 1000 / n_rows, 2)
+            print(f'  {count} processes: {n_rows / ms * 1000:,.0f} reviews/s')
+    return timings
+
+
+# Run in a fresh interpreter by run_startup: time to import the app and until its data is loaded
+STARTUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.reviews.current
+print(json.dumps({'import app': (imported - started) * 1000, 'data ready': (time.perf_counter() - started) * 1000}))
+'''
+
+
+def run_startup(fast_start, top=15):
+    # Cold start of the app with `python -X importtime`: import time per top-level
+    # package (the self times of all its modules), plus import and ready time
+    env = dict(os.environ, FAST_START='1' if fast_start else '0')
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT], env=env,
+                             capture_output=True, text=True, check=True)
+    packages = collections.Counter()
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and 'self [us]' not in line:
+            self_us, _, name = line[len('import time:'):].split('|')
+            packages[name.strip().split('.')[0]] += int(self_us)
+    timings = {f'import: {name}': round(us / 1000, 2) for name, us in packages.most_common(top)}
+    timings['import: total'] = round(sum(packages.values()) / 1000, 2)
+    timings.update({name: round(ms, 2) for name, ms in json.loads(process.stdout.splitlines()[-1]).items()})
+    return timings
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results_path, threshold=1.2):
+    # Latest run of every (scale, scenario) against the latest run of an earlier revision
+    with open(results_path, encoding='utf-8') as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    latest = {}
+    for run in runs:
+        latest[(run['rows'], run['locations'], run['scenario'])] = run
+    for key, run in latest.items():
+        previous = [r for r in runs if (r['rows'], r['locations'], r['scenario']) == key and r['revision'] != run['revision']]
+        if not previous:
+            continue
+        base = previous[-1]
+        scale = f'{key[0]} rows, {key[1]} locations, ' if key[0] else ''
+        print(f"\n{scale}{key[2]}: {base['revision']} -> {run['revision']}")
+        for stage, ms in run['timings'].items():
+            if stage in base['timings'] and base['timings'][stage]:
+                ratio = ms / base['timings'][stage]
+                flag = '  SLOWER' if ratio > threshold and not stage.startswith('response bytes') else ''
+                print(f"  {stage:<50}{base['timings'][stage]:>12}{ms:>12}{ratio:>8.2f}x{flag}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the dashboard callbacks on synthetic review data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000], help='dataset sizes, e.g. 5000 100000 1000000')
+    parser.add_argument('--locations', type=int, nargs='+', default=[50], help='numbers of locations, e.g. 50 1000')
+    parser.add_argument('--scenario', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--chat-base-url', help='also time the chat against this OpenAI-compatible server (openai_stub.py)')
+    parser.add_argument('--results', default='benchmark_results.jsonl', help='file the timings are appended to')
+    parser.add_argument('--write-csv', help='only write a synthetic export with the first --rows/--locations to this path')
+    parser.add_argument('--compare', action='store_true', help='only compare the stored results of the last two revisions')
+    parser.add_argument('--startup', action='store_true', help='only time the cold start of the app, with and without FAST_START')
+    parser.add_argument('--tagging', type=int, nargs='*', metavar='PROCESSES',
+                        help='only time the keyword tagging of --rows reviews with these numbers of processes (default: 1 and one per core)')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.results)
+        raise SystemExit
+    if args.startup:
+        revision = git_revision()
+        with open(args.results, 'a', encoding='utf-8') as f:
+            for fast_start in (False, True):
+                scenario = 'startup, FAST_START' if fast_start else 'startup'
+                timings = run_startup(fast_start)
+                f.write(json.dumps({'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'revision': revision,
+                                    'rows': None, 'locations': None, 'scenario': scenario, 'timings': timings}) + '\n')
+                print(scenario)
+                for stage, ms in timings.items():
+                    print(f'    {stage:<50}{ms:>12} ms')
+        raise SystemExit
+    if args.tagging is not None:
+        revision = git_revision()
+        processes = args.tagging or sorted({1, os.cpu_count()})
+        with open(args.results, 'a', encoding='utf-8') as f:
+            for n_rows in args.rows:
+                print(f'tagging {n_rows} reviews')
+                timings = run_tagging(n_rows, processes)
+                f.write(json.dumps({'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'revision': revision,
+                                    'rows': n_rows, 'locations': None, 'scenario': 'tagging', 'timings': timings}) + '\n')
+        raise SystemExit
+    if args.write_csv:
+        generate_reviews(args.rows[0], args.locations[0]).to_csv(args.write_csv)
+        raise SystemExit
+
+    import app
+    from dataset import ReviewDataset
+    from review_store import ReviewStore
+
+    revision = git_revision()
+    for n_rows in args.rows:
+        for n_locations in args.locations:
+            started = time.perf_counter()
+            dataset = ReviewDataset.from_frame(generate_reviews(n_rows, n_locations))
+            dataset.version = f'synthetic:{n_rows}:{n_locations}'
+            app.reviews = ReviewStore(dataset, app.topics, app.result_cache)
+            app.result_cache.invalidate(dataset.version)
+            print(f'{n_rows} rows, {n_locations} locations: generated and loaded in {time.perf_counter() - started:.1f}s')
+
+            # Scenarios with more locations than the data has would run with fewer
+            # competitors under the wrong name, so they're left out
+            scenarios = [scenario for scenario in args.scenario if scenario_locations(scenario) <= len(dataset.locations)]
+            for scenario in sorted(set(args.scenario) - set(scenarios), key=args.scenario.index):
+                print(f'  skipped {scenario}: needs {scenario_locations(scenario)} locations, the data has {len(dataset.locations)}')
+            runs = {scenario: run_scenario(app, scenario, args.repeats) for scenario in scenarios}
+            if args.chat_base_url:
+                runs['chat'] = run_chat(args.chat_base_url, args.repeats)
+            with open(args.results, 'a', encoding='utf-8') as f:
+                for scenario, timings in runs.items():
+                    f.write(json.dumps({'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'revision': revision,
+                                        'rows': n_rows, 'locations': n_locations, 'scenario': scenario, 'timings': timings}) + '\n')
+                    print(f'  {scenario}')
+                    for stage, ms in timings.items():
+                        print(f"    {stage:<50}{ms:>12}{'' if stage.startswith('response bytes') else ' ms'}")
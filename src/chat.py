@@ -0,0 +1,106 @@
+import argparse
+import time
+
+# The openai package takes over a second to import, more than the rest of the app
+# together, so it's only imported with the first chat message.
+
+# Runs in these states still own the thread; a new message can't be added until they finish
+ACTIVE_RUN_STATES = ('queued', 'in_progress', 'cancelling')
+
+
+def wait_for_run(client, thread_id, run_id, poll_interval=0.5, timeout=60):
+    run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+    deadline = time.monotonic() + timeout
+    while run.status in ACTIVE_RUN_STATES and time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+    return run.status
+
+
+def stream_reply(client, assistant_id, session, question, on_run_created=None):
+    # Yields the assistant's reply piece by piece, as the ThreadMessageDelta events arrive.
+    # The question is sent along with the run (a new thread is created with it on the
+    # first question), so a message is a single streaming request. `session` tracks
+    # the thread, the last run and its status from the run events; the API is only
+    # asked about the run when the previous one never reported that it finished.
+    from openai.types.beta.assistant_stream_event import ThreadMessageDelta
+    from openai.types.beta.threads import Run
+    from openai.types.beta.threads.text_delta_block import TextDeltaBlock
+
+    if session['run_status'] in ACTIVE_RUN_STATES:
+        session['run_status'] = wait_for_run(client, session['thread_id'], session['run_id'])
+    message = {'role': 'user', 'content': question}
+    if session['thread_id'] is None:
+        stream = client.beta.threads.create_and_run(assistant_id=assistant_id, thread={'messages': [message]}, stream=True)
+    else:
+        stream = client.beta.threads.runs.create(thread_id=session['thread_id'], assistant_id=assistant_id,
+                                                 additional_messages=[message], stream=True)
+    for event in stream:
+        if isinstance(event.data, Run):
+            created = event.data.id != session['run_id']
+            session.update(thread_id=event.data.thread_id, run_id=event.data.id, run_status=event.data.status)
+            if created and on_run_created:
+                on_run_created(session)
+        elif isinstance(event, ThreadMessageDelta):
+            for block in event.data.delta.content or []:
+                if isinstance(block, TextDeltaBlock) and block.text and block.text.value:
+                    yield block.text.value
+
+
+def stream_with_progress(chunks, report, min_interval=0.2):
+    # Concatenates the chunks and hands the text so far to `report`, at most every
+    # `min_interval` seconds (each report is a write to the background callback cache)
+    reply = ''
+    reported_at = 0
+    for chunk in chunks:
+        reply += chunk
+        now = time.monotonic()
+        if now - reported_at >= min_interval:
+            report(reply)
+            reported_at = now
+    return reply
+
+
+class ChatSessions:
+    # Chat state of every browser session: its assistant thread, its last run
+    # and how many messages its page shows. Kept in the background job cache, since the runs
+    # execute in job processes; a session expires after `idle_timeout` seconds
+    # without a question.
+    def __init__(self, cache, idle_timeout=3600):
+        self.cache = cache
+        self.idle_timeout = idle_timeout
+
+    def _key(self, session_id):
+        return f'chat-session:{session_id}'
+
+    def get(self, session_id):
+        return self.cache.get(self._key(session_id)) or {'thread_id': None, 'run_id': None, 'run_status': None, 'messages': 0}
+
+    def save(self, session_id, state):
+        self.cache.set(self._key(session_id), state, expire=self.idle_timeout)
+
+
+if __name__ == '__main__':
+    # Requests and time to first token per message, e.g. against openai_stub.py
+    parser = argparse.ArgumentParser(description='Measure round trips and time to first token of chat messages.')
+    parser.add_argument('--base-url', default='http://localhost:8001/v1')
+    parser.add_argument('--api-key', default='stub')
+    parser.add_argument('--assistant-id', default='asst_stub')
+    parser.add_argument('--messages', type=int, default=5)
+    args = parser.parse_args()
+
+    from openai import DefaultHttpxClient, OpenAI
+    requests = []
+    http_client = DefaultHttpxClient(event_hooks={'request': [lambda request: requests.append(request.url.path)]})
+    client = OpenAI(api_key=args.api_key, base_url=args.base_url, http_client=http_client)
+    session = {'thread_id': None, 'run_id': None, 'run_status': None, 'messages': 0}
+    print(f"{'message':<9}{'requests':>9}{'first token ms':>16}{'total ms':>10}")
+    for i in range(args.messages):
+        requests.clear()
+        started = time.perf_counter()
+        first_token = None
+        for chunk in stream_reply(client, args.assistant_id, session, f'Frage {i + 1}'):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+        total = time.perf_counter() - started
+        print(f"{i + 1:<9}{len(requests):>9}{(first_token or total) * 1000:>16.1f}{total * 1000:>10.1f}")
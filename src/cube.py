@@ -0,0 +1,228 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from dataset import days_to_datetime
+
+
+RATING_VALUES = np.arange(1, 6)
+
+
+class GroupAggregate:
+    # Cube cells summed over a set of locations, kept per quarter so both the
+    # all-time panels and the trend line can be answered from the same object
+    def __init__(self, count, rating_sum, topic_rating_hist):
+        self.quarter_count = count                  # (quarters,)
+        self.quarter_rating_sum = rating_sum        # (quarters,)
+        self.quarter_topic_rating_hist = topic_rating_hist  # (quarters, topics, 5)
+
+    @property
+    def count(self):
+        return int(self.quarter_count.sum())
+
+    @property
+    def empty(self):
+        return self.count == 0
+
+    @property
+    def mean_rating(self):
+        return self.quarter_rating_sum.sum() / self.count if self.count else np.nan
+
+    def quarterly_mean_rating(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.quarter_count > 0, self.quarter_rating_sum / self.quarter_count, np.nan)
+
+    @classmethod
+    def combine(cls, groups):
+        # Sum of several groups, e.g. the 'Total' column over all compared selections
+        return cls(
+            sum(g.quarter_count for g in groups),
+            sum(g.quarter_rating_sum for g in groups),
+            sum(g.quarter_topic_rating_hist for g in groups)
+        )
+
+
+# Group aggregates of one comparison: the named groups and the competitors (name -> GroupAggregate,
+# in display order), their total and the quarters the per-quarter arrays run over
+Selection = namedtuple('Selection', ['groups', 'competitor_groups', 'filtered_data', 'quarters'])
+
+
+# Group x topic matrices of one comparison, one row per group in the order of `names`;
+# rating_hist has the ratings 1-5 on a third axis
+TopicMatrix = namedtuple('TopicMatrix', ['names', 'total', 'count', 'share', 'rating_sum', 'mean_rating', 'rating_hist'])
+
+
+def topic_matrix(groups):
+    # Every (group, topic) cell of both topic tables in one go: the per-quarter topic
+    # rating histograms of all groups ({name: GroupAggregate}) stacked and summed over
+    # the quarters, then counts, shares and mean ratings for the whole matrix at once
+    names = list(groups)
+    total = np.array([g.quarter_count.sum() for g in groups.values()], dtype=np.int64)
+    rating_hist = np.stack([g.quarter_topic_rating_hist for g in groups.values()]).sum(axis=1)
+    count = rating_hist.sum(axis=-1)
+    rating_sum = rating_hist @ RATING_VALUES
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = np.where(total[:, None] > 0, count / total[:, None] * 100, 0)
+        mean_rating = np.where(count > 0, rating_sum / count, np.nan)
+    return TopicMatrix(names, total, count, share, rating_sum, mean_rating, rating_hist)
+
+
+def topic_order(matrix):
+    # Topics by their rounded Total share, largest first, as the heatmap lists them
+    return np.argsort(-np.round(matrix.share[0], 1), kind='stable')
+
+
+def quarter_ids(days):
+    # Quarters counted from year 0, e.g. 2024Q2 -> 2024 * 4 + 1
+    months = days_to_datetime(days).astype('datetime64[M]').astype(np.int64)
+    return months // 3 + 1970 * 4
+
+
+def quarter_first_day(quarter):
+    # Day number of the first day of a quarter id
+    return int(np.datetime64((quarter - 1970 * 4) * 3, 'M').astype('datetime64[D]').astype(np.int64))
+
+
+def quarter_range(first_quarter, last_quarter):
+    return pd.period_range(
+        start=pd.Period(year=first_quarter // 4, quarter=first_quarter % 4 + 1, freq='Q'),
+        periods=last_quarter - first_quarter + 1,
+        freq='Q'
+    )
+
+
+class ReviewCube:
+    # Counts, rating sums and rating histograms keyed by location x quarter x topic.
+    # Built once from the raw reviews; queries only touch the selected cells. Queries
+    # limited to a period take whole quarters from the cells and rebin only the reviews
+    # of the two partial quarters at its ends, found through the data's date index.
+    def __init__(self, data, topics):
+        self.topics = list(topics)
+        self.locations = data.locations
+        self.data = data
+
+        quarters = quarter_ids(data.days)
+        self.first_quarter = int(quarters.min()) if len(quarters) else 0
+        last_quarter = int(quarters.max()) if len(quarters) else 0
+        self.quarters = quarter_range(self.first_quarter, last_quarter)
+        self.rating_hist, self.topic_rating_hist = self._histograms(
+            data, slice(None), np.asarray(data.name_codes, dtype=np.int64), quarters - self.first_quarter,
+            len(self.locations), len(self.quarters))
+        self._sum_histograms()
+
+    def _histograms(self, data, rows, loc, quarter, n_loc, n_q):
+        # Rating histograms of data[rows] binned by the given location and quarter
+        # positions, over n_loc x n_q cells
+        n_t, n_r = len(self.topics), len(RATING_VALUES)
+        rating = np.asarray(data.ratings[rows], dtype=np.int64) - 1
+        cell = loc * n_q + quarter
+        rating_hist = np.bincount(cell * n_r + rating, minlength=n_loc * n_q * n_r).reshape(n_loc, n_q, n_r)
+
+        # One bincount over all (review, topic) hits instead of a mask per topic
+        hits, topic = np.nonzero(data.topic_flags(self.topics, rows) == 1)
+        flat = (cell[hits] * n_t + topic) * n_r + rating[hits]
+        topic_rating_hist = np.bincount(flat, minlength=n_loc * n_q * n_t * n_r).reshape(n_loc, n_q, n_t, n_r)
+        return rating_hist, topic_rating_hist
+
+    def _sum_histograms(self):
+        self.count = self.rating_hist.sum(axis=-1)
+        self.rating_sum = self.rating_hist @ RATING_VALUES
+
+    def extended(self, data, start):
+        # Cube of `data` when its rows before `start` are the ones this cube was built
+        # from: the cells are padded for new locations and quarters and only the new
+        # rows are binned into them
+        new_quarters = quarter_ids(data.days[start:])
+        if len(new_quarters) == 0:
+            return self
+        old_last = self.first_quarter + len(self.quarters) - 1
+        first_quarter = min(self.first_quarter, int(new_quarters.min()))
+        last_quarter = max(old_last, int(new_quarters.max()))
+
+        cube = ReviewCube.__new__(ReviewCube)
+        cube.topics = self.topics
+        cube.locations = data.locations
+        cube.data = data
+        cube.first_quarter = first_quarter
+        cube.quarters = quarter_range(first_quarter, last_quarter)
+        pad = [(0, len(data.locations) - len(self.locations)), (self.first_quarter - first_quarter, last_quarter - old_last)]
+        rating_hist, topic_rating_hist = cube._histograms(
+            data, slice(start, None), np.asarray(data.name_codes[start:], dtype=np.int64), new_quarters - first_quarter,
+            len(data.locations), len(cube.quarters))
+        cube.rating_hist = np.pad(self.rating_hist, pad + [(0, 0)]) + rating_hist
+        cube.topic_rating_hist = np.pad(self.topic_rating_hist, pad + [(0, 0), (0, 0)]) + topic_rating_hist
+        cube._sum_histograms()
+        return cube
+
+    def location_index(self, names):
+        idx = self.locations.get_indexer(list(names))
+        return np.unique(idx[idx >= 0])
+
+    def quarter_span(self, period):
+        # Positions of the first and last quarter of `period`, (first_day, last_day), in
+        # self.quarters; last < first when the period has no quarter in the data
+        if period is None:
+            return 0, len(self.quarters) - 1
+        first, last = quarter_ids(np.array(period)) - self.first_quarter
+        return max(int(first), 0), min(int(last), len(self.quarters) - 1)
+
+    def period_quarters(self, period):
+        first, last = self.quarter_span(period)
+        return self.quarters[first:last + 1]
+
+    def period_cells(self, location_ids, period):
+        # Cell arrays of the given locations over the quarters of `period`. Quarters fully
+        # inside it are cube cells as they are; the first and the last one are rebinned
+        # from the reviews of their days inside the period, one index slice per location.
+        first, last = self.quarter_span(period)
+        arrays = [self.rating_hist[location_ids, first:last + 1], self.topic_rating_hist[location_ids, first:last + 1]]
+        if last < first or not len(location_ids):
+            return arrays
+        first_day, last_day = period
+        edges = [(first, first_day, min(last_day, quarter_first_day(self.first_quarter + first + 1) - 1))]
+        if last > first:
+            edges.append((last, max(first_day, quarter_first_day(self.first_quarter + last)), last_day))
+        index = self.data.date_index
+        for position, (quarter, start, end) in enumerate(edges):
+            lo, hi = index.bounds(location_ids, start, end)
+            rows = np.concatenate([index.rows[a:b] for a, b in zip(lo, hi)])
+            loc = np.repeat(np.arange(len(location_ids)), hi - lo)
+            rating_hist, topic_rating_hist = self._histograms(self.data, rows, loc, np.zeros(len(rows), dtype=np.int64), len(location_ids), 1)
+            arrays[0][:, quarter - first] = rating_hist[:, 0]
+            arrays[1][:, quarter - first] = topic_rating_hist[:, 0]
+        return arrays
+
+    def groups(self, location_sets, period=None):
+        # Aggregates of any number of location sets in one pass: the location ids of
+        # all sets back to back, group after group, and one reduceat per cell array
+        # sums each group's segment. Only cube cells are touched, never the reviews,
+        # and a location may be in several groups. With a period, (first_day, last_day),
+        # the quarter axis only runs over its quarters.
+        indices = [self.location_index(names) for names in location_sets]
+        sizes = np.array([len(idx) for idx in indices], dtype=np.int64)
+        rows = np.concatenate(indices) if indices else np.array([], dtype=np.int64)
+        starts = np.cumsum(sizes) - sizes
+        filled = sizes > 0
+        if period is None:
+            cell_arrays = (self.count, self.rating_sum, self.topic_rating_hist)
+        else:
+            # Only the locations in some group are sliced, `rows` then points into those
+            involved = np.unique(rows)
+            rating_hist, topic_rating_hist = self.period_cells(involved, period)
+            rows = np.searchsorted(involved, rows)
+            cell_arrays = (rating_hist.sum(axis=-1), rating_hist @ RATING_VALUES, topic_rating_hist)
+
+        def per_group(cells):
+            sums = np.zeros((len(location_sets),) + cells.shape[1:], dtype=cells.dtype)
+            if rows.size:
+                sums[filled] = np.add.reduceat(cells[rows], starts[filled], axis=0)
+            return sums
+
+        arrays = [per_group(cells) for cells in cell_arrays]
+        return [GroupAggregate(*(array[g] for array in arrays)) for g in range(len(location_sets))]
+
+
+def moving_average_trend(means, window):
+    # Fill quarters without reviews linearly, then smooth every series column-wise
+    return means.interpolate(method='linear').rolling(window=window, min_periods=1).mean()
@@ -0,0 +1,392 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from search_index import SearchIndex
+from topics import TOPIC_COLUMNS
+
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_DIR = 'snapshot'
+
+log = logging.getLogger(__name__)
+
+# Columns of the review exports that are not topic flags
+NON_TOPIC_COLUMNS = {'Review', 'date', 'Rating', 'Num_Reviews', 'name'}
+
+# What the page layout needs of the data: the location names and the first/last day number
+DatasetSummary = namedtuple('DatasetSummary', ['locations', 'first_day', 'last_day'])
+
+
+def topic_columns(columns):
+    # The known topic flags among the columns, in their order. Anything else an export
+    # carries (index columns, extra fields) is left out rather than packed as a flag.
+    ignored = [col for col in columns if col not in TOPIC_COLUMNS and col not in NON_TOPIC_COLUMNS
+               and not str(col).startswith('Unnamed')]
+    if ignored:
+        log.warning('Ignoring columns that are not topic flags: %s', ', '.join(map(str, ignored)))
+    return [col for col in columns if col in TOPIC_COLUMNS]
+
+
+class ReviewText:
+    # Review texts as one UTF-8 blob plus row offsets. Snapshot texts are mapped on
+    # first use; texts parsed from a CSV are packed the same way, so forked gunicorn
+    # workers share the pages instead of touching the refcounts of millions of str objects.
+    def __init__(self, directory=None, offsets=None, blob=None):
+        self.directory = directory
+        self._offsets = offsets
+        self._blob = blob
+
+    @classmethod
+    def from_strings(cls, texts):
+        encoded = [text.encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(offsets=offsets, blob=b''.join(encoded))
+
+    def _open(self):
+        self._offsets = np.load(os.path.join(self.directory, 'review_offsets.npy'), mmap_mode='r')
+        with open(os.path.join(self.directory, 'review_text.bin'), 'rb') as f:
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b''
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            self._open()
+        return self._offsets
+
+    @property
+    def blob(self):
+        if self._blob is None:
+            self._open()
+        return self._blob
+
+    def take(self, rows):
+        offsets, blob = self.offsets, self.blob
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in rows]
+
+    def append(self, other):
+        # Texts of both in one blob; a mapped snapshot blob is copied into memory once
+        offsets = np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]])
+        return ReviewText(offsets=offsets, blob=self.blob[:] + other.blob)
+
+
+def to_day(value):
+    # Day number (days since 1970-01-01) of a date string, Timestamp or datetime64
+    return int(np.datetime64(pd.Timestamp(value), 'D').astype(np.int64))
+
+
+def days_to_datetime(days):
+    dates = np.asarray(days, dtype=np.int64).astype('datetime64[D]')
+    return dates[()] if dates.ndim == 0 else dates
+
+
+def _location_day_keys(name_codes, days):
+    # One sortable int64 per review: location code in the high half, day number (shifted
+    # to be non-negative) in the low half
+    return (np.asarray(name_codes, dtype=np.int64) << 32) + (np.asarray(days, dtype=np.int64) + 2 ** 31)
+
+
+class DateIndex:
+    # Row numbers ordered by (location, day). The rows of one location form one run
+    # and within it the days are sorted, so the reviews of a location between two days
+    # are the contiguous slice rows[lo:hi], found with two binary searches in `keys`
+    # instead of a scan over the whole day column. The dataset's own row order is left
+    # alone: the texts, the search index and the review table all use row numbers.
+    def __init__(self, rows, keys):
+        self.rows = rows
+        self.keys = keys
+
+    @classmethod
+    def build(cls, name_codes, days):
+        keys = _location_day_keys(name_codes, days)
+        rows = np.argsort(keys, kind='stable').astype(np.int32 if len(keys) < 2 ** 31 else np.int64)
+        return cls(rows, keys[rows])
+
+    def extended(self, name_codes, days, start):
+        # Index of the dataset when its rows from `start` on are new: only those are
+        # sorted, then merged into the existing order. Location codes of existing rows
+        # never change on append, so their keys stay valid.
+        new_keys = _location_day_keys(name_codes[start:], days[start:])
+        order = np.argsort(new_keys, kind='stable')
+        positions = np.searchsorted(self.keys, new_keys[order], side='right')
+        rows = np.insert(self.rows, positions, order + start)
+        return DateIndex(rows, np.insert(self.keys, positions, new_keys[order]))
+
+    def bounds(self, location_codes, first_day, last_day):
+        # [lo, hi) into `rows` per location for the days first_day..last_day (inclusive)
+        codes = np.asarray(location_codes, dtype=np.int64)
+        lo = np.searchsorted(self.keys, _location_day_keys(codes, np.full(len(codes), first_day)), side='left')
+        hi = np.searchsorted(self.keys, _location_day_keys(codes, np.full(len(codes), last_day)), side='right')
+        return lo, np.maximum(hi, lo)
+
+    def take(self, location_codes, first_day, last_day):
+        # Row numbers of the given locations between two days, location after location and by day within each
+        lo, hi = self.bounds(location_codes, first_day, last_day)
+        if not len(lo):
+            return np.array([], dtype=self.rows.dtype)
+        return np.concatenate([self.rows[a:b] for a, b in zip(lo, hi)])
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.keys.nbytes
+
+
+class ReviewDataset:
+    # Column arrays of the review data in a compact schema: name is
+    # dictionary-encoded against `locations` (int16 codes), Rating is int8,
+    # dates are int32 day numbers and all topic flags of a review are packed
+    # into one uint16/uint32 bitmask. The text column is only touched when
+    # reviews are displayed.
+    def __init__(self, locations, name_codes, days, ratings, topic_bits, flag_columns, texts):
+        self.locations = pd.Index(locations)
+        self.name_codes = name_codes
+        self.days = days
+        self.ratings = ratings
+        self.topic_bits = topic_bits
+        self.flag_columns = list(flag_columns)
+        self._flag_index = {col: i for i, col in enumerate(self.flag_columns)}
+        self.texts = texts
+        self._date_index = None
+        # Identifies the loaded data, e.g. for keying cached results
+        self.version = f'frame:{len(name_codes)}'
+
+    def __len__(self):
+        return len(self.name_codes)
+
+    def topic_bit(self, topic):
+        return self.topic_bits.dtype.type(1 << self._flag_index[topic])
+
+    def topic_flag(self, topic):
+        return (self.topic_bits >> self._flag_index[topic]) & 1
+
+    def topic_flags(self, topics, rows=None):
+        # Unpacked (reviews, topics) 0/1 matrix, for building aggregates
+        bits = self.topic_bits if rows is None else self.topic_bits[rows]
+        return unpack_topic_bits(bits)[:, [self._flag_index[topic] for topic in topics]]
+
+    def reviews(self, rows):
+        return self.texts.take(rows)
+
+    @property
+    def date_index(self):
+        # Built on first use; two threads racing here just sort twice
+        if self._date_index is None:
+            self._date_index = DateIndex.build(self.name_codes, self.days)
+        return self._date_index
+
+    def summary(self):
+        if not len(self):
+            return DatasetSummary(list(self.locations), None, None)
+        return DatasetSummary(list(self.locations), int(self.days.min()), int(self.days.max()))
+
+    def nbytes(self, include_text=True):
+        size = self.name_codes.nbytes + self.days.nbytes + self.ratings.nbytes + self.topic_bits.nbytes
+        if include_text:
+            size += self.texts.offsets.nbytes + len(self.texts.blob)
+        return size
+
+    def to_frame(self):
+        # Plain DataFrame in the layout of the CSV exports, for code that still works on frames
+        frame = pd.DataFrame({'Review': self.reviews(np.arange(len(self)))})
+        flags = unpack_topic_bits(self.topic_bits)
+        for i, col in enumerate(self.flag_columns):
+            frame[col] = flags[:, i].astype(np.int64)
+        frame['date'] = pd.to_datetime(days_to_datetime(self.days))
+        frame['Rating'] = np.asarray(self.ratings, dtype=np.int64)
+        frame['name'] = self.locations[np.asarray(self.name_codes)]
+        return frame
+
+    @classmethod
+    def from_frame(cls, frame):
+        name_codes, locations = pd.factorize(frame['name'])
+        flag_columns = topic_columns(frame.columns)
+        dates = pd.to_datetime(frame['date']).to_numpy(dtype='datetime64[D]')
+        return cls(
+            locations,
+            name_codes.astype(np.int16 if len(locations) < 2 ** 15 else np.int32),
+            dates.astype(np.int64).astype(np.int32),
+            frame['Rating'].to_numpy().astype(np.int8),
+            pack_topic_bits(frame[flag_columns].to_numpy()),
+            flag_columns,
+            ReviewText.from_strings(frame['Review'].fillna(''))
+        )
+
+
+    def append(self, frame):
+        # New dataset with the rows of `frame` added at the end. Only the new rows are
+        # parsed; locations and topic columns not seen before are added after the existing
+        # ones, so the codes and bits of the existing rows stay valid.
+        new = ReviewDataset.from_frame(frame)
+        locations = self.locations.append(new.locations.difference(self.locations, sort=False))
+        flag_columns = self.flag_columns + [col for col in new.flag_columns if col not in self._flag_index]
+        new_flags = pd.DataFrame(unpack_topic_bits(new.topic_bits)[:, :len(new.flag_columns)], columns=new.flag_columns)
+        new_bits = pack_topic_bits(new_flags.reindex(columns=flag_columns, fill_value=0).to_numpy())
+        code_dtype = np.int16 if len(locations) < 2 ** 15 else np.int32
+        bits_dtype = np.promote_types(self.topic_bits.dtype, new_bits.dtype)
+        dataset = ReviewDataset(
+            locations,
+            np.concatenate([self.name_codes, locations.get_indexer(new.locations)[new.name_codes]]).astype(code_dtype),
+            np.concatenate([self.days, new.days]),
+            np.concatenate([self.ratings, new.ratings]),
+            np.concatenate([self.topic_bits, new_bits]).astype(bits_dtype),
+            flag_columns,
+            self.texts.append(new.texts)
+        )
+        if self._date_index is not None:
+            dataset._date_index = self._date_index.extended(dataset.name_codes, dataset.days, len(self))
+        dataset.version = f'{self.version}+{len(new)}'
+        return dataset
+
+
+def pack_topic_bits(flags):
+    # (reviews, topics) 0/1 matrix -> one uint16 (or uint32 for more than 16 topics) per review
+    dtype = np.uint16 if flags.shape[1] <= 16 else np.uint32
+    weights = (1 << np.arange(flags.shape[1], dtype=np.int64)).astype(dtype)
+    return ((flags != 0).astype(dtype) * weights).sum(axis=1, dtype=dtype)
+
+
+def unpack_topic_bits(bits):
+    bits = np.ascontiguousarray(bits)
+    width = bits.dtype.itemsize * 8
+    return np.unpackbits(bits.view(np.uint8).reshape(len(bits), bits.dtype.itemsize), axis=1, bitorder='little', count=width)
+
+
+def memory_report(csv_path):
+    # Bytes per review of the CSV-parsed DataFrame vs. the compact dataset
+    frame = pd.read_csv(csv_path)
+    frame['date'] = pd.to_datetime(frame['date'])
+    dataset = ReviewDataset.from_frame(frame)
+    n = max(len(frame), 1)
+    frame_columns = frame.drop(columns=['Review']).memory_usage(deep=True, index=False).sum()
+    return {
+        'reviews': len(frame),
+        'frame_bytes_per_review': round(frame.memory_usage(deep=True).sum() / n, 1),
+        'frame_bytes_per_review_without_text': round(frame_columns / n, 1),
+        'compact_bytes_per_review': round(dataset.nbytes() / n, 1),
+        'compact_bytes_per_review_without_text': round(dataset.nbytes(include_text=False) / n, 1),
+        # Built on load, next to the compact columns
+        'date_index_bytes_per_review': round(dataset.date_index.nbytes / n, 1)
+    }
+
+
+def read_csv(path):
+    dataset = ReviewDataset.from_frame(pd.read_csv(path))
+    dataset.version = f'csv:{os.path.basename(path)}:{os.path.getmtime(path)}:{len(dataset)}'
+    return dataset
+
+
+def write_snapshot(dataset, directory, sources=()):
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    np.save(os.path.join(directory, 'name.npy'), dataset.name_codes)
+    np.save(os.path.join(directory, 'day.npy'), dataset.days)
+    np.save(os.path.join(directory, 'rating.npy'), dataset.ratings)
+    np.save(os.path.join(directory, 'topic_bits.npy'), dataset.topic_bits)
+
+    # Review text goes into its own blob so loading the snapshot never decodes it
+    np.save(os.path.join(directory, 'review_offsets.npy'), dataset.texts.offsets)
+    with open(os.path.join(directory, 'review_text.bin'), 'wb') as f:
+        f.write(dataset.texts.blob)
+    SearchIndex.build(dataset.reviews(range(len(dataset)))).save(directory)
+
+    # meta.json is written last and marks the snapshot as complete
+    summary = dataset.summary()
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'rows': len(dataset),
+        'locations': summary.locations,
+        'first_day': summary.first_day,
+        'last_day': summary.last_day,
+        'flag_columns': dataset.flag_columns,
+        'sources': [os.path.basename(path) for path in sources]
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def read_snapshot(directory):
+    with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['version'] != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot {directory} has version {meta['version']}, expected {SNAPSHOT_VERSION}")
+
+    def column(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+    dataset = ReviewDataset(
+        meta['locations'],
+        column('name'),
+        column('day'),
+        column('rating'),
+        column('topic_bits'),
+        meta['flag_columns'],
+        ReviewText(directory=directory)
+    )
+    dataset.version = f"snapshot:{os.path.getmtime(os.path.join(directory, 'meta.json'))}:{meta['rows']}"
+    return dataset
+
+
+def snapshot_is_current(directory, csv_path):
+    meta_path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['version'] != SNAPSHOT_VERSION or os.path.basename(csv_path) not in meta['sources']:
+        return False
+    return not os.path.exists(csv_path) or os.path.getmtime(meta_path) >= os.path.getmtime(csv_path)
+
+
+def read_summary(csv_path, snapshot_dir=SNAPSHOT_DIR):
+    # Summary from the metadata of a current snapshot, without loading any column.
+    # None if there is no such snapshot or it was written before the date bounds were stored.
+    if not snapshot_is_current(snapshot_dir, csv_path):
+        return None
+    with open(os.path.join(snapshot_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    if 'first_day' not in meta:
+        return None
+    return DatasetSummary(meta['locations'], meta['first_day'], meta['last_day'])
+
+
+def load_dataset(csv_path, snapshot_dir=SNAPSHOT_DIR):
+    # Prefer the memory-mapped snapshot; fall back to parsing the CSV when it is missing or stale
+    if snapshot_is_current(snapshot_dir, csv_path):
+        return read_snapshot(snapshot_dir)
+    return read_csv(csv_path)
+
+
+def build_snapshot(csv_paths, directory=SNAPSHOT_DIR, stats=None):
+    # Exports usually overlap, so the files are merged without their shared reviews
+    # (merge.py, which builds on this module)
+    from merge import merge_sources
+    frame = pd.concat(merge_sources(csv_paths, stats), ignore_index=True)
+    dataset = ReviewDataset.from_frame(frame)
+    write_snapshot(dataset, directory, csv_paths)
+    return dataset
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert review CSV exports into a columnar snapshot.')
+    parser.add_argument('csv', nargs='+', help='review CSV export(s)')
+    parser.add_argument('--out', default=SNAPSHOT_DIR, help='snapshot directory (default: %(default)s)')
+    parser.add_argument('--report', action='store_true', help='only print bytes per review before/after compaction')
+    args = parser.parse_args()
+    if args.report:
+        for path in args.csv:
+            print(path, memory_report(path))
+        raise SystemExit
+    stats = []
+    dataset = build_snapshot(args.csv, args.out, stats)
+    for row in stats:
+        print(f"{row['source']}: {row['reviews']} reviews, {row['duplicates']} already in an earlier file")
+    print(f'Wrote {len(dataset)} reviews from {len(args.csv)} file(s) to {args.out}')
@@ -0,0 +1,156 @@
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from werkzeug.utils import secure_filename
+
+from cube import GroupAggregate, ReviewCube, moving_average_trend, topic_matrix, topic_order
+from dataset import SNAPSHOT_DIR, load_dataset, to_day
+from topics import DASHBOARD_TOPICS
+
+
+# Output formats and the package pandas needs for them (None: always there)
+FORMATS = {'csv': None, 'parquet': 'pyarrow', 'xlsx': 'openpyxl'}
+
+# Window of the moving average of the trend table, as on the dashboard
+TREND_WINDOW = 4
+
+# Set in the parent before the pool is started; forked workers share it instead of
+# rebuilding the cube or pickling it per task
+_exporter = None
+
+
+class Exporter:
+    # Topic-share, average-rating and quarterly-trend tables of one location (or location
+    # group) against a fixed competitor set, from the same cube and topic matrix the
+    # dashboard panels are built from. Competitors that are part of the group itself
+    # are left out of its tables.
+    def __init__(self, cube, competitors, period, out_dir, formats):
+        self.cube = cube
+        self.competitors = list(competitors)
+        self.period = period
+        self.out_dir = out_dir
+        self.formats = list(formats)
+
+    def tables(self, name, locations):
+        # {table name: DataFrame} and the number of reviews of the group
+        competitors = [competitor for competitor in self.competitors if competitor not in locations and competitor != name]
+        aggregates = self.cube.groups([locations] + [[competitor] for competitor in competitors], self.period)
+        groups = {name: aggregates[0], **dict(zip(competitors, aggregates[1:]))}
+        matrix = topic_matrix({'Total': GroupAggregate.combine(aggregates), **groups})
+
+        order = topic_order(matrix)
+        index = pd.Index([self.cube.topics[t] for t in order], name='Topic')
+        shares = pd.DataFrame(np.round(matrix.share[:, order], 1).T, index=index, columns=matrix.names)
+        ratings = pd.DataFrame(np.round(matrix.mean_rating[:, order], 1).T, index=index, columns=matrix.names)
+        counts = pd.DataFrame(matrix.count[:, order].T, index=index, columns=[f'{n} (Anzahl)' for n in matrix.names])
+
+        shown = {n: group for n, group in groups.items() if not group.empty}
+        quarters = self.cube.period_quarters(self.period)
+        trend = moving_average_trend(
+            pd.DataFrame({n: group.quarterly_mean_rating() for n, group in shown.items()}, index=quarters, columns=list(shown)),
+            TREND_WINDOW
+        ).round(3)
+        trend.index = pd.Index(quarters.astype(str), name='Quartal')
+        return {
+            'topic_share': shares,
+            'average_rating': pd.concat([ratings, counts], axis=1),
+            'quarterly_trend': trend
+        }, aggregates[0].count
+
+    def export(self, task):
+        # Writes the tables of one group; returns its name, number of reviews and seconds taken
+        started = time.perf_counter()
+        position, name, locations = task
+        tables, count = self.tables(name, locations)
+        # Numbered, since names that only differ in umlauts or punctuation map to the same file name
+        stem = os.path.join(self.out_dir, f'{position:04d}-{secure_filename(name) or "standort"}')
+        for fmt in self.formats:
+            if fmt == 'xlsx':
+                with pd.ExcelWriter(f'{stem}.xlsx') as writer:
+                    for table, frame in tables.items():
+                        frame.to_excel(writer, sheet_name=table)
+                continue
+            for table, frame in tables.items():
+                path = f'{stem}-{table}.{fmt}'
+                if fmt == 'csv':
+                    frame.to_csv(path)
+                else:
+                    frame.to_parquet(path)
+        return name, count, time.perf_counter() - started
+
+
+def _export(task):
+    return _exporter.export(task)
+
+
+def export_all(exporter, groups, processes=None, chunksize=4):
+    # Exports every (name, locations) group, spread over a pool of forked processes
+    global _exporter
+    _exporter = exporter
+    os.makedirs(exporter.out_dir, exist_ok=True)
+    tasks = [(i, name, list(locations)) for i, (name, locations) in enumerate(groups)]
+    if processes == 1:
+        return [_export(task) for task in tasks]
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        return pool.map(_export, tasks, chunksize=chunksize)
+
+
+def read_groups(path, locations):
+    # {"Nord": ["Standort A", "Standort B"], ...}; without a file every location is its own group
+    if not path:
+        return [(location, [location]) for location in locations]
+    with open(path, encoding='utf-8') as f:
+        groups = json.load(f)
+    unknown = sorted({location for names in groups.values() for location in names} - set(locations))
+    if unknown:
+        raise SystemExit(f'Unknown locations in {path}: {", ".join(unknown)}')
+    return list(groups.items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the heatmap, average-rating and trend tables of every location.')
+    parser.add_argument('csv', help='review CSV export (the snapshot is used when it is current)')
+    parser.add_argument('--snapshot', default=SNAPSHOT_DIR, help='snapshot directory (default: %(default)s)')
+    parser.add_argument('--out', default='exports', help='output directory (default: %(default)s)')
+    parser.add_argument('--groups', help='JSON file with location groups, {name: [locations]}; default: every location')
+    parser.add_argument('--competitors', nargs='*', default=[], help='competitor locations shown next to every group')
+    parser.add_argument('--competitors-file', help='file with one competitor location per line')
+    parser.add_argument('--start', help='first day of the period, e.g. 2023-01-01 (default: all reviews)')
+    parser.add_argument('--end', help='last day of the period')
+    parser.add_argument('--format', nargs='+', default=['csv'], choices=list(FORMATS),
+                        help='output formats; parquet needs pyarrow, xlsx needs openpyxl')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    args = parser.parse_args()
+
+    missing = [FORMATS[fmt] for fmt in args.format if FORMATS[fmt] and importlib.util.find_spec(FORMATS[fmt]) is None]
+    if missing:
+        parser.error(f'install {", ".join(missing)} for the requested formats')
+
+    started = time.perf_counter()
+    data = load_dataset(args.csv, args.snapshot)
+    cube = ReviewCube(data, DASHBOARD_TOPICS)
+    competitors = list(args.competitors)
+    if args.competitors_file:
+        with open(args.competitors_file, encoding='utf-8') as f:
+            competitors += [line.strip() for line in f if line.strip()]
+    unknown = sorted(set(competitors) - set(data.locations))
+    if unknown:
+        parser.error(f'unknown competitors: {", ".join(unknown)}')
+    period = None
+    if args.start or args.end:
+        summary = data.summary()
+        period = (to_day(args.start) if args.start else summary.first_day, to_day(args.end) if args.end else summary.last_day)
+    data.date_index  # sorted once in the parent, the workers share it
+    loaded = time.perf_counter() - started
+
+    groups = read_groups(args.groups, list(data.locations))
+    results = export_all(Exporter(cube, competitors, period, args.out, args.format), groups, args.processes)
+    print(f'Exported {len(results)} groups ({sum(count for _, count, _ in results)} reviews) to {args.out} '
+          f'in {time.perf_counter() - started:.1f}s ({loaded:.1f}s loading, '
+          f'{sum(seconds for _, _, seconds in results):.1f}s of work in {args.processes or os.cpu_count()} processes)')
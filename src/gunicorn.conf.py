@@ -0,0 +1,22 @@
+import gc
+import os
+
+
+# Shared-data mode: import app.py (dataset, cube, layout) once in the master and
+# fork the workers from it. The review columns are plain NumPy arrays or mmaps
+# and location names are integer codes, so the pages stay shared after fork
+# instead of being copied into every worker.
+# FAST_START=1 turns it off: the dataset loads in a background thread, and threads
+# don't survive the fork, so every worker loads its own (the snapshot's mmapped
+# columns are still shared through the page cache).
+preload_app = os.environ.get('SHARED_DATA', '1') == '1' and os.environ.get('FAST_START') != '1'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+
+def when_ready(server):
+    if preload_app:
+        # Keep the collector from writing to the headers of objects created
+        # during the preload, which would un-share their pages in every worker
+        gc.freeze()
+    server.log.info("Shared-data mode %s, %s workers; run `python memstats.py %s` for unique vs. shared memory",
+                    'on' if preload_app else 'off', workers, os.getpid())
@@ -0,0 +1,53 @@
+import argparse
+import os
+
+
+# Fields of /proc/<pid>/smaps_rollup, all in kB
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def process_memory(pid='self'):
+    # Unique (private) vs. shared resident memory of one process, in MB. Linux only.
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in SMAPS_FIELDS:
+                values[key] = int(rest.split()[0])
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        'pid': os.getpid() if pid == 'self' else int(pid),
+        'rss_mb': mb(values['Rss']),
+        'pss_mb': mb(values['Pss']),
+        'unique_mb': mb(values['Private_Clean'] + values['Private_Dirty']),
+        'shared_mb': mb(values['Shared_Clean'] + values['Shared_Dirty'])
+    }
+
+
+def child_pids(pid):
+    children = []
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            children += [int(child) for child in f.read().split()]
+    return children
+
+
+def worker_report(master_pid):
+    rows = [dict(process_memory(master_pid), role='master')]
+    rows += [dict(process_memory(child), role='worker') for child in child_pids(master_pid)]
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report unique vs. shared memory of a gunicorn master and its workers.')
+    parser.add_argument('master_pid', help='pid of the gunicorn master process')
+    args = parser.parse_args()
+
+    rows = worker_report(args.master_pid)
+    print(f"{'role':<8}{'pid':>8}{'rss MB':>10}{'pss MB':>10}{'unique MB':>12}{'shared MB':>12}")
+    for row in rows:
+        print(f"{row['role']:<8}{row['pid']:>8}{row['rss_mb']:>10}{row['pss_mb']:>10}{row['unique_mb']:>12}{row['shared_mb']:>12}")
+    workers = [row for row in rows if row['role'] == 'worker']
+    if workers:
+        print(f"workers: {len(workers)}, total unique {sum(row['unique_mb'] for row in workers):.1f} MB, "
+              f"total pss {sum(row['pss_mb'] for row in rows):.1f} MB")
@@ -0,0 +1,124 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from tagging import tag_frame
+from topics import TOPIC_COLUMNS
+
+
+# Reviews read per step, per source
+CHUNK_SIZE = 50000
+
+
+class Fingerprints:
+    # 64-bit review hashes, sorted, with how often each occurred: 12 bytes per distinct
+    # review, and vectorized binary-search lookups instead of a Python set of ints
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.counts.nbytes
+
+    def lookup(self, keys):
+        # Occurrences of every key so far, 0 for unseen ones
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.uint32)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, self.counts[positions], 0).astype(np.uint32)
+
+    def update(self, keys, counts, combine=np.add):
+        # Merges (distinct, sorted) keys with their counts in; known keys get
+        # combine(old count, new count)
+        positions = np.searchsorted(self.keys, keys)
+        known = positions < len(self.keys)
+        known[known] = self.keys[positions[known]] == keys[known]
+        self.counts[positions[known]] = combine(self.counts[positions[known]], counts[known])
+        self.keys = np.insert(self.keys, positions[~known], keys[~known])
+        self.counts = np.insert(self.counts, positions[~known], counts[~known])
+
+
+def fingerprint(frame):
+    # 64-bit hash of every review's location, day and text. Case, umlaut spelling and
+    # whitespace are normalized, so re-exports with reflowed text still match.
+    # Folded like search_index.normalize, but with str.replace, several times faster than translate
+    text = [' '.join(str(review).casefold().replace('ä', 'ae').replace('ö', 'oe').replace('ü', 'ue').split())
+            for review in frame['Review'].fillna('')]
+    key = pd.DataFrame({
+        'name': frame['name'].astype(str).str.strip(),
+        'day': pd.to_datetime(frame['date']).to_numpy(dtype='datetime64[D]').astype(np.int64),
+        'text': text
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+
+# Columns of the merged data: the review text, the topic columns in their usual order,
+# then date, rating, reviewer and location. Index columns, named "Unnamed: 0" or not
+# named at all, and any other extra columns are dropped.
+MERGED_COLUMNS = ['Review'] + TOPIC_COLUMNS + ['date', 'Rating', 'Num_Reviews', 'name']
+
+
+def merge_sources(paths, stats=None, chunksize=CHUNK_SIZE):
+    # Streams the reviews of all sources, in order, with the reviews of earlier sources
+    # left out, as chunks with the same columns. A review is a duplicate when its
+    # fingerprint already occurred in an earlier source. Within one source nothing is
+    # dropped: two "Super" on the same day at a location are two reviewers, so a
+    # fingerprint that occurs k times in an earlier source covers k occurrences in a
+    # later one. Memory grows with the distinct reviews, not with the input.
+    # Per-source counts are appended to `stats` (a list) as the sources are read.
+    merged = Fingerprints()
+    for path in paths:
+        started = time.perf_counter()
+        source = Fingerprints()
+        row = {'source': path, 'reviews': 0, 'duplicates': 0, 'kept': 0}
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            keys = fingerprint(chunk)
+            order = np.argsort(keys, kind='stable')
+            distinct, first, counts = np.unique(keys[order], return_index=True, return_counts=True)
+            # 0-based occurrence of every review's fingerprint within its source
+            occurrence = np.empty(len(keys), dtype=np.int64)
+            occurrence[order] = np.arange(len(keys)) - np.repeat(first, counts) + np.repeat(source.lookup(distinct), counts)
+            duplicate = occurrence < merged.lookup(keys)
+            source.update(distinct, counts.astype(np.uint32))
+
+            row['reviews'] += len(chunk)
+            row['duplicates'] += int(duplicate.sum())
+            # Topic columns a source lacks are tagged by keyword, like dropped exports
+            kept = tag_frame(chunk[~duplicate]).reindex(columns=MERGED_COLUMNS, fill_value=0)
+            row['kept'] += len(kept)
+            yield kept
+        merged.update(source.keys, source.counts, np.maximum)
+        row.update(seconds=round(time.perf_counter() - started, 3), distinct_total=len(merged), fingerprint_bytes=merged.nbytes)
+        if stats is not None:
+            stats.append(row)
+
+
+def merge_csv(paths, out, chunksize=CHUNK_SIZE):
+    # Writes the merged sources to one CSV; returns the per-source merge statistics
+    stats = []
+    header = True
+    for chunk in merge_sources(paths, stats, chunksize):
+        chunk.to_csv(out, mode='w' if header else 'a', header=header, index=False)
+        header = False
+    return pd.DataFrame(stats).set_index('source')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge review CSV exports into one CSV without the reviews they share.')
+    parser.add_argument('csv', nargs='+', help='review CSV exports, earlier ones win')
+    parser.add_argument('--out', default='merged_reviews.csv', help='merged CSV (default: %(default)s)')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help='reviews read per step (default: %(default)s)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = merge_csv(args.csv, args.out, args.chunksize)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(stats)
+    print(f"Merged {stats['reviews'].sum()} reviews into {stats['kept'].sum()} ({stats['duplicates'].sum()} duplicates) "
+          f'in {args.out} in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,296 @@
+import bisect
+import collections
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'customerxm_request_seconds': 'Time to answer an HTTP request, by route.',
+    'customerxm_callback_seconds': 'Time spent in a dashboard callback function.',
+    'customerxm_stage_seconds': 'Time spent in one stage of a dashboard or chat callback.',
+}
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_TIMER = _NoTimer()
+
+
+class _StageTimer:
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe('customerxm_stage_seconds', time.perf_counter() - self.started, self.labels)
+        return False
+
+
+class Metrics:
+    # Stage timers, latency histograms and counters, served in Prometheus text
+    # format on /metrics. Every process (gunicorn workers and the chat's job
+    # processes) collects in memory and adds its numbers to a disk cache every
+    # `flush_interval` seconds, so a scrape sees the sum over all of them
+    # whichever worker answers it. Without a cache everything is a no-op.
+    KEY = 'metrics:totals'
+
+    def __init__(self, cache=None, flush_interval=5):
+        self.cache = cache
+        self.enabled = cache is not None
+        self.flush_interval = flush_interval
+        self.profiler = None
+        self._histograms = {}
+        self._counters = collections.Counter()
+        self._counter_sources = []
+        self._source_totals = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        # Forked processes start empty, or they'd flush the parent's numbers a second time
+        os.register_at_fork(after_in_child=self._reset)
+
+    @classmethod
+    def from_env(cls, server, cache):
+        # METRICS=1 collects and serves /metrics. PROFILE_SLOW_REQUESTS=<seconds> samples the
+        # stacks of every request and writes those of slower ones to PROFILE_DIR.
+        metrics = cls(cache if os.environ.get('METRICS') == '1' else None)
+        if metrics.enabled:
+            server.before_request(metrics._start_request)
+            server.after_request(metrics._finish_request)
+            server.add_url_rule('/metrics', 'metrics', metrics.serve)
+        if os.environ.get('PROFILE_SLOW_REQUESTS'):
+            metrics.profiler = SlowRequestProfiler(float(os.environ['PROFILE_SLOW_REQUESTS']),
+                                                   os.environ.get('PROFILE_DIR', 'profiles'))
+            server.before_request(metrics.profiler.start)
+            server.after_request(metrics.profiler.stop)
+        return metrics
+
+    def _reset(self):
+        self._histograms = {}
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+        # The counter sources are copied with the process: only increments made in the
+        # child are the child's to flush, the rest the parent still flushes itself
+        self._source_totals = {name: total for source in self._counter_sources for name, total in source().items()}
+
+    def stage(self, callback, stage):
+        # with metrics.stage('topic_heatmap', 'table'): ...
+        if not self.enabled:
+            return NO_TIMER
+        return _StageTimer(self, (('callback', callback), ('stage', stage)))
+
+    def timed(self, callback):
+        # Decorator for a callback function; the rest of its request is counted as serialization
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    self.observe('customerxm_callback_seconds', elapsed, (('callback', callback),))
+                    if has_request_context():
+                        g.metrics_callback = (callback, elapsed)
+            return wrapper
+        return decorator
+
+    def time_to_first(self, items, callback, stage):
+        # Passes `items` through and records how long the first one took, e.g. a streamed reply's first token
+        if not self.enabled:
+            return items
+        return self._time_to_first(items, (('callback', callback), ('stage', stage)))
+
+    def _time_to_first(self, items, labels):
+        started = time.perf_counter()
+        for i, item in enumerate(items):
+            if i == 0:
+                self.observe('customerxm_stage_seconds', time.perf_counter() - started, labels)
+            yield item
+
+    def observe(self, name, seconds, labels=()):
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._histograms.get((name, labels))
+            if entry is None:
+                entry = self._histograms[(name, labels)] = [0] * (len(BUCKETS) + 1) + [0.0]
+            entry[bisect.bisect_left(BUCKETS, seconds)] += 1
+            entry[-1] += seconds
+
+    def inc(self, name, value=1, labels=()):
+        if self.enabled:
+            with self._lock:
+                self._counters[(name, labels)] += value
+
+    def count_from(self, source):
+        # `source()` returns running totals kept elsewhere ({name: total}); the increase
+        # since the last flush is added to the counters of the same name
+        if self.enabled:
+            self._counter_sources.append(source)
+
+    def gauge(self, name, source):
+        # Read from this process at scrape time
+        if self.enabled:
+            self._gauges[name] = source
+
+    def flush(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            histograms, counters = self._histograms, self._counters
+            self._histograms, self._counters = {}, collections.Counter()
+            for source in self._counter_sources:
+                for name, total in source().items():
+                    counters[(name, ())] += total - self._source_totals.get(name, 0)
+                    self._source_totals[name] = total
+        if not histograms and not any(counters.values()):
+            return
+        with self.cache.transact():
+            totals = self.cache.get(self.KEY) or {'histograms': {}, 'counters': {}}
+            for key, entry in histograms.items():
+                stored = totals['histograms'].get(key)
+                totals['histograms'][key] = [a + b for a, b in zip(stored, entry)] if stored else entry
+            for key, value in counters.items():
+                totals['counters'][key] = totals['counters'].get(key, 0) + value
+            self.cache.set(self.KEY, totals)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Could not flush metrics')
+
+    def _start_request(self):
+        # Threads don't survive gunicorn's fork, every worker starts its own flusher on its first request
+        if self._flusher_pid != os.getpid():
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, daemon=True, name='metrics-flusher').start()
+        g.metrics_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        elapsed = time.perf_counter() - g.pop('metrics_started', time.perf_counter())
+        route = request.url_rule.rule if request.url_rule else 'other'
+        self.observe('customerxm_request_seconds', elapsed, (('route', route), ('status', str(response.status_code))))
+        callback = g.pop('metrics_callback', None)
+        if callback:
+            # Dash encodes the outputs after the callback returns, that's most of the remainder
+            name, callback_seconds = callback
+            self.observe('customerxm_stage_seconds', max(elapsed - callback_seconds, 0),
+                         (('callback', name), ('stage', 'serialize')))
+        return response
+
+    def render(self):
+        self.flush()
+        totals = self.cache.get(self.KEY) or {'histograms': {}, 'counters': {}}
+        lines = []
+        by_name = collections.defaultdict(list)
+        for (name, labels), entry in totals['histograms'].items():
+            by_name[name].append((labels, entry))
+        for name, series in sorted(by_name.items()):
+            lines += [f'# HELP {name} {HELP.get(name, name)}', f'# TYPE {name} histogram']
+            for labels, entry in sorted(series):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), entry):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {entry[-1]:.6f}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        counters = collections.defaultdict(list)
+        for (name, labels), value in totals['counters'].items():
+            counters[name].append((labels, value))
+        for name, series in sorted(counters.items()):
+            lines.append(f'# TYPE {name} counter')
+            lines += [f'{name}{_labels(labels)} {value}' for labels, value in sorted(series)]
+        for name, source in sorted(self._gauges.items()):
+            lines += [f'# TYPE {name} gauge', f'{name} {source()}']
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return re.sub(r'(["\\])', r'\\\1', str(value)).replace('\n', r'\n')
+
+
+class SlowRequestProfiler:
+    # Sampling profiler for the request threads: a background thread records their
+    # stacks every `interval` seconds. Requests slower than `threshold` seconds get
+    # their stacks written to `directory` in the collapsed format of flamegraph.pl
+    # and speedscope ("frame;frame;frame count" per line).
+    def __init__(self, threshold, directory, interval=0.005):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self._active = {}
+        self._sampler_pid = None
+
+    def start(self):
+        # Threads don't survive gunicorn's fork, every worker starts its own sampler
+        if self._sampler_pid != os.getpid():
+            self._sampler_pid = os.getpid()
+            threading.Thread(target=self._sample, daemon=True, name='slow-request-profiler').start()
+        g.profile_started = time.perf_counter()
+        self._active[threading.get_ident()] = collections.Counter()
+
+    def stop(self, response):
+        stacks = self._active.pop(threading.get_ident(), None)
+        elapsed = time.perf_counter() - g.pop('profile_started', time.perf_counter())
+        if stacks and elapsed > self.threshold:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{request.path.strip('/').replace('/', '_') or 'index'}.txt"
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in stacks.most_common())
+            log.warning('Slow request %s took %.2fs, %s samples written to %s', request.path, elapsed,
+                        sum(stacks.values()), name)
+        return response
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in list(self._active.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                if stack:
+                    stacks[';'.join(reversed(stack))] += 1
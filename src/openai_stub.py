@@ -0,0 +1,127 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+
+
+# Local stand-in for the parts of the OpenAI Assistants API the chat uses, for
+# offline and load testing. Start it and point the app at it:
+#   python openai_stub.py --port 8001 --delay 0.05
+#   OPENAI_BASE_URL=http://localhost:8001/v1 gunicorn --chdir src -c src/gunicorn.conf.py app:server
+# Any API key is accepted. Replies are streamed as thread.message.delta events.
+
+REPLY = ("In den 1-Sterne-Bewertungen zum Thema Freundlichkeit geht es vor allem um lange Wartezeiten "
+         "bei der Fahrzeugübergabe, unklare Absprachen zu Terminen und das Gefühl, als Kunde nicht ernst "
+         "genommen zu werden. Mehrfach wird auch die Erreichbarkeit per Telefon bemängelt.")
+
+stub = Flask(__name__)
+settings = {'delay': 0.05, 'reply': REPLY}
+threads = {}
+ids = itertools.count(1)
+lock = threading.Lock()
+
+
+def new_id(prefix):
+    with lock:
+        return f'{prefix}_stub{next(ids)}'
+
+
+def run_object(thread_id, run_id, assistant_id, status):
+    return {'id': run_id, 'object': 'thread.run', 'created_at': int(time.time()), 'thread_id': thread_id,
+            'assistant_id': assistant_id, 'status': status, 'model': 'stub', 'instructions': '', 'tools': []}
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def add_message(thread_id, role, content):
+    message = {'id': new_id('msg'), 'object': 'thread.message', 'created_at': int(time.time()), 'thread_id': thread_id,
+               'role': role, 'status': 'completed',
+               'content': [{'type': 'text', 'text': {'value': content, 'annotations': []}}]}
+    threads.setdefault(thread_id, {'messages': [], 'runs': {}})['messages'].append(message)
+    return message
+
+
+@stub.get('/v1/assistants/<assistant_id>')
+def retrieve_assistant(assistant_id):
+    return jsonify({'id': assistant_id, 'object': 'assistant', 'created_at': 0, 'name': 'stub', 'model': 'stub',
+                    'instructions': '', 'tools': []})
+
+
+@stub.post('/v1/threads')
+def create_thread():
+    thread_id = new_id('thread')
+    threads[thread_id] = {'messages': [], 'runs': {}}
+    return jsonify({'id': thread_id, 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}})
+
+
+@stub.post('/v1/threads/<thread_id>/messages')
+def create_message(thread_id):
+    body = request.get_json()
+    return jsonify(add_message(thread_id, body['role'], body['content']))
+
+
+@stub.get('/v1/threads/<thread_id>/runs')
+def list_runs(thread_id):
+    runs = list(threads.get(thread_id, {}).get('runs', {}).values())
+    return jsonify({'object': 'list', 'data': runs, 'first_id': None, 'last_id': None, 'has_more': False})
+
+
+@stub.get('/v1/threads/<thread_id>/runs/<run_id>')
+def retrieve_run(thread_id, run_id):
+    return jsonify(threads[thread_id]['runs'][run_id])
+
+
+def stream_run(thread_id, assistant_id):
+    run_id = new_id('run')
+    message_id = new_id('msg')
+    thread = threads.setdefault(thread_id, {'messages': [], 'runs': {}})
+    thread['runs'][run_id] = run_object(thread_id, run_id, assistant_id, 'in_progress')
+    # Split into word-sized tokens, keeping the whitespace
+    tokens = [word + ' ' for word in settings['reply'].split(' ')]
+
+    def events():
+        yield sse('thread.run.created', run_object(thread_id, run_id, assistant_id, 'queued'))
+        yield sse('thread.run.in_progress', thread['runs'][run_id])
+        for token in tokens:
+            time.sleep(settings['delay'])
+            yield sse('thread.message.delta', {
+                'id': message_id, 'object': 'thread.message.delta',
+                'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': token, 'annotations': []}}]}
+            })
+        thread['runs'][run_id] = run_object(thread_id, run_id, assistant_id, 'completed')
+        yield sse('thread.run.completed', thread['runs'][run_id])
+        yield 'event: done\ndata: [DONE]\n\n'
+
+    return Response(events(), mimetype='text/event-stream')
+
+
+@stub.post('/v1/threads/<thread_id>/runs')
+def create_run(thread_id):
+    body = request.get_json()
+    for message in body.get('additional_messages') or []:
+        add_message(thread_id, message['role'], message['content'])
+    return stream_run(thread_id, body['assistant_id'])
+
+
+@stub.post('/v1/threads/runs')
+def create_thread_and_run():
+    body = request.get_json()
+    thread_id = new_id('thread')
+    threads[thread_id] = {'messages': [], 'runs': {}}
+    for message in body.get('thread', {}).get('messages', []):
+        add_message(thread_id, message['role'], message['content'])
+    return stream_run(thread_id, body['assistant_id'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a local stub of the OpenAI Assistants streaming API.')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds between streamed tokens')
+    args = parser.parse_args()
+    settings['delay'] = args.delay
+    stub.run(port=args.port, threaded=True)
@@ -0,0 +1,44 @@
+import json
+import os
+import threading
+
+from flask import request
+
+
+class PayloadStats:
+    # Bytes each callback output puts on the wire, taken from the responses of
+    # /_dash-update-component. Counts are per worker, like the cache stats.
+    def __init__(self):
+        self.outputs = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, server):
+        stats = cls()
+        if os.environ.get('PAYLOAD_REPORT') == '1':
+            server.after_request(stats.record)
+        return stats
+
+    def record(self, response):
+        if response.status_code != 200 or not response.is_json:
+            return response
+        if not request.path.endswith('/_dash-update-component'):
+            return response
+        body = response.get_json(silent=True) or {}
+        sizes = {}
+        for component_id, props in body.get('response', {}).items():
+            for prop, value in props.items():
+                sizes[f'{component_id}.{prop}'] = len(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        with self._lock:
+            for output, size in sizes.items():
+                entry = self.outputs.setdefault(output, {'calls': 0, 'total_bytes': 0, 'max_bytes': 0})
+                entry['calls'] += 1
+                entry['total_bytes'] += size
+                entry['max_bytes'] = max(entry['max_bytes'], size)
+                entry['last_bytes'] = size
+        return response
+
+    def report(self):
+        with self._lock:
+            rows = {output: dict(entry, mean_bytes=round(entry['total_bytes'] / entry['calls'])) for output, entry in self.outputs.items()}
+        return dict(sorted(rows.items(), key=lambda item: -item[1]['mean_bytes']))
@@ -0,0 +1,172 @@
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    # In-process LRU with a TTL; every gunicorn worker keeps its own copy
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            stored_at, value = entry
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskBackend:
+    # One pickle file per entry in a directory all gunicorn workers share.
+    # The file mtime doubles as last-access time for LRU eviction and the TTL.
+    def __init__(self, directory, max_entries=2048, ttl=3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return False, None
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        # Guard against hash collisions
+        return (True, value) if stored_key == key else (False, None)
+
+    def set(self, key, value):
+        # Write to a temp file and rename, so readers in other workers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class ResultCache:
+    # Memoizes dashboard computations on their (already normalized) arguments.
+    # Keys include the dataset version, so a reloaded dataset never sees stale entries.
+    def __init__(self, backend, version=''):
+        self.backend = backend
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, version=''):
+        # RESULT_CACHE=memory (default) or disk; the disk cache is shared by all workers
+        max_entries = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+        ttl = int(os.environ.get('RESULT_CACHE_TTL', 3600))
+        if os.environ.get('RESULT_CACHE', 'memory') == 'disk':
+            directory = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'customerxm-cache'))
+            return cls(DiskBackend(directory, max_entries, ttl), version)
+        return cls(MemoryBackend(max_entries, ttl), version)
+
+    def memoize(self, func=None, name=None):
+        if func is None:
+            return functools.partial(self.memoize, name=name)
+        name = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = repr((self.version, name, args))
+            found, value = self.backend.get(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            value = func(*args)
+            self.backend.set(key, value)
+            return value
+        return wrapper
+
+    def invalidate(self, version=None):
+        # Called when the dataset is reloaded
+        if version is not None:
+            self.version = version
+        self.backend.clear()
+
+    def switch_version(self, version):
+        # Called when reviews are ingested: keys of the new version miss on their own. The
+        # shared disk cache is left alone, since other workers may still be serving their
+        # version from it, and old keys age out through its LRU and TTL. The memory cache
+        # only holds this process's old version, so it is emptied right away.
+        self.version = version
+        if isinstance(self.backend, MemoryBackend):
+            self.backend.clear()
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': self.version
+        }
@@ -0,0 +1,169 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from cube import ReviewCube
+from review_table import ReviewTable
+from search_index import SearchIndex
+from tagging import tag_frame
+
+
+log = logging.getLogger(__name__)
+
+# Everything the callbacks read for one version of the data. It is replaced as a
+# whole, so a callback that takes `store.current` once never mixes two versions.
+LoadedReviews = namedtuple('LoadedReviews', ['data', 'search_index', 'cube', 'review_table'])
+
+
+class ReviewStore:
+    # Holds the loaded reviews and adds new review exports without a restart.
+    # CSV files put into `drop_dir` are picked up by a polling thread in every
+    # worker (each gunicorn worker keeps its own copy), parsed on their own and
+    # appended: the search index and the cube only process the new rows.
+    def __init__(self, data, topics, cache, drop_dir=None, poll_interval=30, wait_timeout=20):
+        self.topics = list(topics)
+        self.cache = cache
+        self.drop_dir = drop_dir
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+        self.load_error = None
+        self._summary = None
+        self._current = None
+        self._loaded = threading.Event()
+        if data is not None:
+            self._current = self._build(data)
+            self._loaded.set()
+        self.ingested = set()
+        # Running totals of this process, for the metrics
+        self.stats = {'files_ingested': 0, 'files_failed': 0, 'reviews_ingested': 0, 'ingest_seconds': 0.0}
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._watcher_pid = None
+
+    @classmethod
+    def in_background(cls, load, summary, topics, cache, **kwargs):
+        # Starts without data and runs `load()` in a thread; until it's done `summary()`
+        # returns the given DatasetSummary and `current` waits for the data
+        store = cls(None, topics, cache, **kwargs)
+        store._summary = summary
+        threading.Thread(target=store._load, args=(load,), daemon=True, name='review-loader').start()
+        return store
+
+    def _build(self, data):
+        # Sorted here rather than on the first request that slices by date
+        data.date_index
+        search_index = SearchIndex.for_dataset(data)
+        return LoadedReviews(data, search_index, ReviewCube(data, self.topics), ReviewTable(data, search_index, self.cache))
+
+    def _load(self, load):
+        started = time.perf_counter()
+        try:
+            data = load()
+            self.cache.version = data.version
+            self._current = self._build(data)
+        except Exception as e:
+            log.exception('Could not load the reviews')
+            self.load_error = e
+        else:
+            log.info('Loaded %s reviews in %.2fs', len(data), time.perf_counter() - started)
+        self._loaded.set()
+
+    @property
+    def ready(self):
+        return self._loaded.is_set() and self.load_error is None
+
+    @property
+    def current(self):
+        # Requests that come in while the data is still loading wait for it, up to `wait_timeout`
+        # seconds (keep that below gunicorn's worker timeout)
+        if not self._loaded.wait(self.wait_timeout):
+            raise TimeoutError('The reviews are still loading')
+        if self.load_error is not None:
+            raise RuntimeError('Loading the reviews failed') from self.load_error
+        return self._current
+
+    def summary(self):
+        if self._loaded.is_set() and self._current is not None:
+            return self._current.data.summary()
+        return self._summary
+
+    def append(self, frame, source):
+        with self._lock:
+            old = self.current
+            start = len(old.data)
+            data = old.data.append(frame)
+            # Deterministic, so workers that ingested the same files share disk cache entries
+            data.version = f'{old.data.version}+{source}:{len(frame)}'
+            search_index = old.search_index.extended(data.reviews(range(start, len(data))))
+            cube = old.cube.extended(data, start)
+            self._current = LoadedReviews(data, search_index, cube, ReviewTable(data, search_index, self.cache))
+            # Only after the swap: results computed from the old data can't land under the new version
+            self.cache.switch_version(data.version)
+        return self.current
+
+    def pending_files(self):
+        # CSVs in the drop directory not ingested yet, oldest name first. Files still
+        # being written (modified in the last 2 seconds) wait for the next poll.
+        if not self.drop_dir or not os.path.isdir(self.drop_dir):
+            return []
+        now = time.time()
+        return [
+            os.path.join(self.drop_dir, name) for name in sorted(os.listdir(self.drop_dir))
+            if name.endswith('.csv') and name not in self.ingested
+            and now - os.path.getmtime(os.path.join(self.drop_dir, name)) > 2
+        ]
+
+    def poll(self):
+        # Files dropped while the data is still loading wait for the next poll
+        if not self.ready:
+            return 0
+        added = 0
+        with self._poll_lock:
+            for path in self.pending_files():
+                name = os.path.basename(path)
+                started = time.perf_counter()
+                try:
+                    # Raw exports without topic columns are tagged by keyword on the way in
+                    frame = tag_frame(pd.read_csv(path))
+                    self.append(frame, f'{name}:{os.path.getmtime(path)}')
+                except Exception:
+                    log.exception('Could not ingest %s', path)
+                    self.stats['files_failed'] += 1
+                else:
+                    added += len(frame)
+                    self.stats['files_ingested'] += 1
+                    self.stats['reviews_ingested'] += len(frame)
+                    self.stats['ingest_seconds'] += time.perf_counter() - started
+                    log.info('Ingested %s reviews from %s in %.2fs, now %s', len(frame), name,
+                             time.perf_counter() - started, len(self.current.data))
+                self.ingested.add(name)
+        return added
+
+    def save_upload(self, file, name):
+        # Written under a temp name and renamed, so a poll never reads half a file
+        os.makedirs(self.drop_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.drop_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            file.save(f)
+        path = os.path.join(self.drop_dir, name)
+        os.replace(tmp_path, path)
+        # Backdate it past the settle time of pending_files
+        os.utime(path, (time.time() - 5, time.time() - 5))
+        return path
+
+    def ensure_watching(self):
+        # Threads don't survive gunicorn's fork, so every worker starts its own on its first request
+        if not self.drop_dir or self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, daemon=True, name='review-drop-watcher').start()
+
+    def _watch(self):
+        while True:
+            self.poll()
+            time.sleep(self.poll_interval)
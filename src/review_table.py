@@ -0,0 +1,165 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from dataset import days_to_datetime, to_day
+from search_index import match_offsets
+
+
+MARKDOWN_SPECIAL = re.compile(r'([\\`*_{}\[\]()#+\-.!|<>~])')
+
+# Operators of the DataTable filter row, in the order they have to be tried
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                    ['contains '], ['datestartswith ']]
+
+COMPARISONS = {
+    'ge': np.greater_equal, 'le': np.less_equal, 'lt': np.less,
+    'gt': np.greater, 'ne': np.not_equal, 'eq': np.equal
+}
+
+
+def split_filter_part(filter_part):
+    # '{Rating} s>= 3' -> ('Rating', 'ge', '3'), as in the Dash DataTable backend examples
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    value = value_part
+                return name, operator_type[0].strip(), value
+    return [None] * 3
+
+
+def highlight_markdown(text, offsets):
+    # Escape the review for markdown and wrap the search hits in bold markers
+    escape = lambda part: MARKDOWN_SPECIAL.sub(r'\\\1', part)
+    pieces = []
+    position = 0
+    for start, end in offsets:
+        pieces.append(escape(text[position:start]))
+        pieces.append('**' + escape(text[start:end]) + '**')
+        position = end
+    pieces.append(escape(text[position:]))
+    return ''.join(pieces)
+
+
+def _rank(order):
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank
+
+
+class ReviewTable:
+    # Backend of filtered-reviews-table. The rows matching a filter state are
+    # cached, sorted through rank arrays precomputed over the whole dataset,
+    # and only the visible page is decoded and serialized.
+    def __init__(self, data, search_index, cache=None):
+        self.data = data
+        self.search_index = search_index
+        self.sort_ranks = {
+            'date': _rank(np.argsort(data.days, kind='stable')),
+            'Rating': _rank(np.lexsort((data.days, data.ratings)))
+        }
+        if cache is not None:
+            self.filter_rows = cache.memoize(self._filter_rows, name='review_table.filter_rows')
+        else:
+            self.filter_rows = lru_cache(maxsize=64)(self._filter_rows)
+
+    def _search(self, rows, search_term):
+        # Rows whose review contains the search term. The index match is exact
+        # when the term is a single word; phrases are confirmed on the texts.
+        candidates = self.search_index.candidates(search_term)
+        if candidates is not None:
+            rows = np.intersect1d(rows, candidates, assume_unique=True)
+        if candidates is None or not re.fullmatch(r'\w+', search_term):
+            texts = self.data.reviews(rows)
+            rows = rows[[bool(match_offsets(text, search_term)) for text in texts]] if len(rows) else rows
+        return rows
+
+    def _apply_column_filter(self, rows, selected_topic, filter_query):
+        data = self.data
+        for filter_part in filter_query.split(' && '):
+            col_name, operator, value = split_filter_part(filter_part)
+            if not col_name or value == '':
+                continue
+            if col_name == 'Review':
+                rows = self._search(rows, value)
+            elif col_name == 'date':
+                if operator in COMPARISONS:
+                    # Half-typed or invalid dates are skipped, like invalid ratings below
+                    try:
+                        day = to_day(value)
+                    except (ValueError, pd.errors.ParserError):
+                        continue
+                    rows = rows[COMPARISONS[operator](data.days[rows], day)]
+                else:
+                    days = np.datetime_as_string(days_to_datetime(data.days[rows]), unit='D')
+                    rows = rows[np.char.find(days, value) == 0 if operator == 'datestartswith' else np.char.find(days, value) >= 0]
+            elif col_name in ('Rating', selected_topic):
+                column = data.ratings if col_name == 'Rating' else data.topic_flag(selected_topic)
+                try:
+                    number = float(value)
+                except ValueError:
+                    continue
+                rows = rows[COMPARISONS.get(operator, np.equal)(column[rows], number)]
+        return rows
+
+    def _filter_rows(self, selected_topic, selected_standort, start_date, end_date, rating_min, rating_max, search_term, filter_query):
+        data = self.data
+        location_code = data.locations.get_indexer([selected_standort])[0]
+        # The location's reviews in the date range are one slice of the date index; sorted
+        # back into row order, which is the order of the table when it isn't sorted
+        rows = np.sort(data.date_index.take([location_code], to_day(start_date), to_day(end_date)))
+        rows = rows[
+            (data.topic_bits[rows] & data.topic_bit(selected_topic) != 0) &
+            (data.ratings[rows] >= rating_min) &
+            (data.ratings[rows] <= rating_max)
+        ]
+        if search_term:
+            rows = self._search(rows, search_term)
+        if filter_query:
+            rows = self._apply_column_filter(rows, selected_topic, filter_query)
+        return rows
+
+    def page(self, rows, sort_by, page_current, page_size):
+        # Row numbers of one page, in the requested sort order
+        start = page_current * page_size
+        stop = start + page_size
+        if not sort_by or len(rows) == 0:
+            return rows[start:stop]
+        column = sort_by[0]['column_id']
+        descending = sort_by[0]['direction'] == 'desc'
+        if column in self.sort_ranks:
+            keys = self.sort_ranks[column][rows]
+        elif column == 'Review':
+            keys = _rank(np.argsort(np.array([text.casefold() for text in self.data.reviews(rows)], dtype=object), kind='stable'))
+        else:
+            return rows[start:stop]
+        if descending:
+            keys = -keys
+        # Only the rows up to the end of the requested page have to be ordered
+        if stop < len(rows):
+            head = np.argpartition(keys, stop - 1)[:stop]
+            order = head[np.argsort(keys[head], kind='stable')]
+        else:
+            order = np.argsort(keys, kind='stable')
+        return rows[order[start:stop]]
+
+    def records(self, rows, selected_topic, search_term):
+        data = self.data
+        texts = data.reviews(rows)
+        if search_term:
+            texts = [highlight_markdown(text, match_offsets(text, search_term)) for text in texts]
+        return pd.DataFrame({
+            'date': pd.to_datetime(days_to_datetime(data.days[rows])),
+            'Review': texts,
+            'Rating': data.ratings[rows],
+            selected_topic: data.topic_flag(selected_topic)[rows]
+        }).to_dict('records')
@@ -0,0 +1,174 @@
+import os
+import re
+from array import array
+
+import numpy as np
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Umlauts are folded to their two-letter spelling so "Übergabe" also finds
+# "Uebergabe"; casefold() already turns ß into ss.
+UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue'})
+
+
+def normalize(text):
+    return text.casefold().translate(UMLAUTS)
+
+
+def _normalize_with_positions(text):
+    # Normalized text plus, for every normalized character, the index of the
+    # original character it came from (normalizing can change the length)
+    pieces = []
+    positions = []
+    for i, ch in enumerate(text):
+        folded = normalize(ch)
+        pieces.append(folded)
+        positions.extend([i] * len(folded))
+    return ''.join(pieces), positions
+
+
+def match_offsets(text, query):
+    # (start, end) offsets of every hit of `query` in the original `text`
+    needle = normalize(query.strip())
+    if not needle:
+        return []
+    haystack, positions = _normalize_with_positions(text)
+    offsets = []
+    start = haystack.find(needle)
+    while start >= 0:
+        end = start + len(needle)
+        offsets.append((positions[start], positions[end - 1] + 1))
+        start = haystack.find(needle, end)
+    return offsets
+
+
+def _trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+class SearchIndex:
+    # Inverted index over the review texts, with a sorted vocabulary. Substring
+    # lookups go through a trigram index over the vocabulary. Posting lists are
+    # sorted row numbers in CSR layout.
+    def __init__(self, vocabulary, pointers, postings, n_rows):
+        self.vocabulary = vocabulary
+        self.pointers = pointers
+        self.postings = postings
+        self.n_rows = n_rows
+        self._term_cache = {}
+
+        # Trigram -> ids of the vocabulary terms containing it, for substring lookups
+        index = {}
+        for i, term in enumerate(vocabulary):
+            for gram in _trigrams(term):
+                index.setdefault(gram, array('i')).append(i)
+        self._trigram_index = {gram: np.frombuffer(ids, dtype=np.int32) for gram, ids in index.items()}
+
+    @classmethod
+    def build(cls, texts):
+        term_ids = {}
+        rows = array('i')
+        terms = array('i')
+        n_rows = 0
+        for row, text in enumerate(texts):
+            n_rows += 1
+            for term in set(TOKEN_RE.findall(normalize(text))):
+                terms.append(term_ids.setdefault(term, len(term_ids)))
+                rows.append(row)
+
+        # Renumber terms in sorted order, then group the postings by term
+        vocabulary = sorted(term_ids)
+        rank = np.empty(len(term_ids), dtype=np.int32)
+        rank[[term_ids[term] for term in vocabulary]] = np.arange(len(vocabulary), dtype=np.int32)
+        terms = rank[np.frombuffer(terms, dtype=np.int32)]
+        rows = np.frombuffer(rows, dtype=np.int32)
+        order = np.lexsort((rows, terms))
+        pointers = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=pointers[1:])
+        return cls(vocabulary, pointers, rows[order], n_rows)
+
+    def extended(self, texts):
+        # Index of the indexed rows plus `texts` as the rows after them. Only the new
+        # texts are tokenized; both posting lists are renumbered to the merged
+        # vocabulary and regrouped, old rows staying ahead of new ones per term.
+        new = SearchIndex.build(texts)
+        vocabulary = sorted(set(self.vocabulary).union(new.vocabulary))
+        term_ids = {term: i for i, term in enumerate(vocabulary)}
+        terms = np.concatenate([
+            np.repeat(np.array([term_ids[term] for term in self.vocabulary], dtype=np.int32), np.diff(self.pointers)),
+            np.repeat(np.array([term_ids[term] for term in new.vocabulary], dtype=np.int32), np.diff(new.pointers))
+        ])
+        rows = np.concatenate([self.postings, new.postings + self.n_rows]).astype(np.int32)
+        order = np.argsort(terms, kind='stable')
+        pointers = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=pointers[1:])
+        return SearchIndex(vocabulary, pointers, rows[order], self.n_rows + new.n_rows)
+
+    @classmethod
+    def for_dataset(cls, dataset):
+        # Use the index stored next to a snapshot, otherwise build one from the texts
+        directory = dataset.texts.directory
+        if directory and os.path.exists(os.path.join(directory, 'search_vocabulary.txt')):
+            return cls.load(directory, len(dataset))
+        return cls.build(dataset.reviews(range(len(dataset))))
+
+    def save(self, directory):
+        with open(os.path.join(directory, 'search_vocabulary.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.vocabulary))
+        np.save(os.path.join(directory, 'search_pointers.npy'), self.pointers)
+        np.save(os.path.join(directory, 'search_postings.npy'), self.postings)
+
+    @classmethod
+    def load(cls, directory, n_rows):
+        with open(os.path.join(directory, 'search_vocabulary.txt'), encoding='utf-8') as f:
+            content = f.read()
+        return cls(
+            content.split('\n') if content else [],
+            np.load(os.path.join(directory, 'search_pointers.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'search_postings.npy'), mmap_mode='r'),
+            n_rows
+        )
+
+    def _substring_terms(self, fragment):
+        if len(fragment) < 3:
+            return np.array([i for i, term in enumerate(self.vocabulary) if fragment in term], dtype=np.int64)
+        candidates = None
+        for gram in _trigrams(fragment):
+            ids = self._trigram_index.get(gram)
+            if ids is None:
+                return np.array([], dtype=np.int64)
+            candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+        return np.array([i for i in candidates if fragment in self.vocabulary[i]], dtype=np.int64)
+
+    def _matching_terms(self, fragment):
+        if fragment not in self._term_cache:
+            if len(self._term_cache) > 1024:
+                self._term_cache.clear()
+            self._term_cache[fragment] = self._substring_terms(fragment)
+        return self._term_cache[fragment]
+
+    def _rows_for_terms(self, term_ids):
+        if len(term_ids) == 0:
+            return np.array([], dtype=np.int32)
+        if len(term_ids) == 1:
+            t = term_ids[0]
+            return np.asarray(self.postings[self.pointers[t]:self.pointers[t + 1]])
+        hits = np.zeros(self.n_rows, dtype=bool)
+        for t in term_ids:
+            hits[self.postings[self.pointers[t]:self.pointers[t + 1]]] = True
+        return np.flatnonzero(hits)
+
+    def candidates(self, query):
+        # Rows containing every token of the query (as a substring of a word), or None
+        # if the query has no word characters to look up
+        fragments = TOKEN_RE.findall(normalize(query))
+        if not fragments:
+            return None
+        rows = None
+        for fragment in sorted(set(fragments), key=len, reverse=True):
+            matched = self._rows_for_terms(self._matching_terms(fragment))
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+            if len(rows) == 0:
+                break
+        return rows
@@ -0,0 +1,120 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from cube import RATING_VALUES
+
+
+# Two-sided level of the tests, and the confidence level of the bootstrap intervals
+ALPHA = 0.05
+
+# Bootstrap resamples drawn per batch, so the draws of a comparison with many
+# competitors stay a few MB
+BOOTSTRAP_BATCH = 200
+
+# Per (group, topic) cell of a TopicMatrix: +1 significantly above the rest of the
+# comparison, -1 below, 0 not distinguishable from noise. Row 0 (Total) is always 0.
+# share_p/rating_p are the p-values of the tests, NaN where a side has too few reviews.
+Significance = namedtuple('Significance', ['share', 'rating', 'share_p', 'rating_p'])
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+
+
+def two_sided_p(z):
+    # p-value of a standard normal test statistic
+    p = _erfc(np.abs(np.nan_to_num(z, nan=0.0)) / math.sqrt(2)).astype(float)
+    return np.where(np.isnan(z), np.nan, p)
+
+
+def _rest(matrix):
+    # Every group is tested against the rest of the comparison, Total minus the group.
+    # Groups can share locations, so the difference is clipped at zero.
+    group_hist = matrix.rating_hist[1:]
+    rest_hist = np.maximum(matrix.rating_hist[0] - group_hist, 0)
+    group_total = matrix.total[1:, None]
+    rest_total = np.maximum(matrix.total[0] - group_total, 0)
+    return group_hist, rest_hist, group_total, rest_total
+
+
+def share_test(matrix):
+    # Two-proportion z-test of every topic share, all cells at once; returns the z-scores
+    group_hist, rest_hist, n1, n2 = _rest(matrix)
+    x1, x2 = group_hist.sum(axis=-1), rest_hist.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pooled = (x1 + x2) / (n1 + n2)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / n1 + 1 / n2))
+        z = (x1 / n1 - x2 / n2) / se
+    # No test without reviews on both sides or when every review (or none) mentions the topic
+    return np.where((n1 > 0) & (n2 > 0) & (se > 0), z, np.nan)
+
+
+def _moments(hist):
+    # Count, mean and sample variance of the ratings of every histogram cell
+    n = hist.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (hist @ RATING_VALUES) / n
+        var = (hist @ RATING_VALUES ** 2 - n * mean ** 2) / (n - 1)
+    return n, mean, var
+
+
+def rating_test(matrix):
+    # Welch test of every topic's mean rating (normal approximation); returns the z-scores
+    group_hist, rest_hist, _, _ = _rest(matrix)
+    n1, mean1, var1 = _moments(group_hist)
+    n2, mean2, var2 = _moments(rest_hist)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        se = np.sqrt(var1 / n1 + var2 / n2)
+        z = (mean1 - mean2) / se
+    return np.where((n1 > 1) & (n2 > 1) & (se > 0), z, np.nan)
+
+
+def _percentile_excludes_zero(differences):
+    # +1/-1 where the central (1 - ALPHA) interval of the resampled differences lies
+    # entirely above/below zero. Cells without reviews on a side are NaN in every resample.
+    low, high = np.percentile(np.nan_to_num(differences), [100 * ALPHA / 2, 100 * (1 - ALPHA / 2)], axis=0)
+    return np.where(low > 0, 1, np.where(high < 0, -1, 0))
+
+
+def bootstrap(matrix, resamples, seed=0):
+    # Percentile bootstrap of both differences to the rest of the comparison. The review
+    # counts of a cell are redrawn from its rating histogram (multinomial) and from its
+    # share (binomial), for all cells and a batch of resamples per NumPy call.
+    rng = np.random.default_rng(seed)
+    group_hist, rest_hist, n1, n2 = _rest(matrix)
+    shape = group_hist.shape[:2]
+    n1, n2 = np.broadcast_to(n1, shape), np.broadcast_to(n2, shape)
+    share_diffs, rating_diffs = [], []
+    for start in range(0, resamples, BOOTSTRAP_BATCH):
+        size = (min(BOOTSTRAP_BATCH, resamples - start),) + shape
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hits1 = rng.binomial(n1, np.where(n1 > 0, group_hist.sum(axis=-1) / n1, 0), size=size)
+            hits2 = rng.binomial(n2, np.where(n2 > 0, rest_hist.sum(axis=-1) / n2, 0), size=size)
+            share_diffs.append(hits1 / n1 - hits2 / n2)
+            means = []
+            for hist in (group_hist, rest_hist):
+                n = hist.sum(axis=-1)
+                draws = rng.multinomial(n, hist / np.maximum(n, 1)[..., None], size=size)
+                means.append((draws @ RATING_VALUES) / n)
+            rating_diffs.append(means[0] - means[1])
+    return _percentile_excludes_zero(np.concatenate(share_diffs)), _percentile_excludes_zero(np.concatenate(rating_diffs))
+
+
+def significance(matrix, resamples=0):
+    # Significance of every cell of a TopicMatrix against the rest of the comparison.
+    # With `resamples` the direction comes from bootstrap intervals instead of the tests.
+    share_z, rating_z = share_test(matrix), rating_test(matrix)
+    share_p, rating_p = two_sided_p(share_z), two_sided_p(rating_z)
+    if resamples:
+        share, rating = bootstrap(matrix, resamples)
+        # A side without reviews has no interval
+        share = np.where(np.isnan(share_p), 0, share)
+        rating = np.where(np.isnan(rating_p), 0, rating)
+    else:
+        share = np.where(share_p < ALPHA, np.sign(share_z), 0)
+        rating = np.where(rating_p < ALPHA, np.sign(rating_z), 0)
+
+    def with_total(values, fill):
+        return np.concatenate([np.full((1,) + values.shape[1:], fill), values])
+    return Significance(with_total(share, 0).astype(np.int8), with_total(rating, 0).astype(np.int8),
+                        with_total(share_p, np.nan), with_total(rating_p, np.nan))
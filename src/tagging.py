@@ -0,0 +1,167 @@
+import argparse
+import functools
+import multiprocessing
+import operator
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from search_index import normalize
+from topics import TOPIC_COLUMNS, TOPIC_KEYWORDS
+
+
+# Reviews read, tagged and written per step of tag_csv
+CHUNK_SIZE = 20000
+
+
+def _trie_pattern(words):
+    # Regex matching any of the words, as a prefix tree: at every position the regex
+    # engine follows one branch per character instead of trying each word in turn,
+    # which keeps it fast with a few hundred stems
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def pattern(node):
+        ends = '' in node
+        branches = [re.escape(ch) + pattern(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f'(?:{"|".join(branches)})'
+        return f'(?:{body})?' if ends else body
+    return pattern(trie)
+
+
+class TopicTagger:
+    # Tags reviews with topics by the keyword stems of each topic (topics.TOPIC_KEYWORDS).
+    # Every topic is one bit of a per-review mask, in the order of `topics`.
+    def __init__(self, keywords, topics=None):
+        self.topics = list(topics or keywords)
+        masks = {}
+        for i, topic in enumerate(self.topics):
+            for stem in keywords.get(topic, []):
+                masks[stem] = masks.get(stem, 0) | 1 << i
+        # The regex finds the longest stem at a position ("termingerecht", not "termin"),
+        # so every stem also carries the topics of the stems inside it
+        self._masks = {stem: functools.reduce(operator.or_, [mask for other, mask in masks.items() if other in stem])
+                       for stem in masks}
+        self._regex = re.compile(_trie_pattern(masks))
+        self._dtype = np.uint16 if len(self.topics) <= 16 else np.uint32
+
+    def tag(self, text):
+        mask = 0
+        for stem in set(self._regex.findall(normalize(text))):
+            mask |= self._masks[stem]
+        return mask
+
+    def tag_texts(self, texts):
+        # One topic bitmask per text; missing texts have no topics
+        return np.fromiter((self.tag(text) if isinstance(text, str) else 0 for text in texts),
+                           dtype=self._dtype, count=len(texts))
+
+    def flags(self, bits):
+        # Bitmasks -> (reviews, topics) 0/1 matrix
+        return ((bits[:, None] >> np.arange(len(self.topics), dtype=bits.dtype)) & 1).astype(np.int64)
+
+
+TAGGER = TopicTagger(TOPIC_KEYWORDS, TOPIC_COLUMNS)
+
+
+def tag_frame(frame, tagger=TAGGER, retag=False):
+    # The frame with a 0/1 column per topic. Topic columns already in the export are
+    # kept unless `retag`; missing ones are added after the review text, in topic order.
+    missing = [topic for topic in tagger.topics if retag or topic not in frame.columns]
+    if not missing:
+        return frame
+    texts = frame['Review'].to_numpy() if 'Review' in frame.columns else np.full(len(frame), None)
+    flags = tagger.flags(tagger.tag_texts(texts))
+    frame = frame.copy()
+    position = frame.columns.get_loc('Review') + 1 if 'Review' in frame.columns else len(frame.columns)
+    for topic in missing:
+        values = flags[:, tagger.topics.index(topic)]
+        if topic in frame.columns:
+            frame[topic] = values
+        else:
+            frame.insert(position, topic, values)
+            position += 1
+    return frame
+
+
+# Set by tag_csv before the pool is forked
+_retag = False
+
+
+def _tag_chunk(frame):
+    return tag_frame(frame, retag=_retag)
+
+
+def tag_csv(path, out, processes=None, chunksize=CHUNK_SIZE, retag=False):
+    # Streams a review CSV through the tagger: chunks are read one after another, tagged
+    # in a pool of forked processes and written in input order, so memory stays at a few
+    # chunks whatever the file size. Returns the number of reviews tagged.
+    global _retag
+    _retag = retag
+    chunks = pd.read_csv(path, chunksize=chunksize)
+    tagged = 0
+    header = True
+    if processes == 1:
+        results = map(_tag_chunk, chunks)
+        pool = None
+    else:
+        pool = multiprocessing.get_context('fork').Pool(processes)
+        results = pool.imap(_tag_chunk, chunks)
+    try:
+        for frame in results:
+            frame.to_csv(out, mode='w' if header else 'a', header=header, index=False)
+            header = False
+            tagged += len(frame)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return tagged
+
+
+def evaluate(frame, tagger=TAGGER):
+    # Agreement of the tagger with the topic columns of an already tagged export
+    bits = tagger.tag_texts(frame['Review'].to_numpy())
+    predicted = tagger.flags(bits).astype(bool)
+    rows = []
+    for i, topic in enumerate(tagger.topics):
+        if topic not in frame.columns:
+            continue
+        actual = frame[topic].fillna(0).to_numpy().astype(bool)
+        hits = (predicted[:, i] & actual).sum()
+        precision = hits / predicted[:, i].sum() if predicted[:, i].any() else np.nan
+        recall = hits / actual.sum() if actual.any() else np.nan
+        rows.append({'Topic': topic, 'tagged': actual.mean(), 'predicted': predicted[:, i].mean(),
+                     'precision': precision, 'recall': recall, 'f1': 2 * precision * recall / (precision + recall)})
+    return pd.DataFrame(rows).set_index('Topic').round(3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tag review CSVs with the topic columns by keyword, without any external service.')
+    parser.add_argument('csv', help='review CSV export')
+    parser.add_argument('--out', help='tagged CSV to write (default: <csv>-tagged.csv)')
+    parser.add_argument('--retag', action='store_true', help='replace topic columns the export already has')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help='reviews per chunk (default: %(default)s)')
+    parser.add_argument('--evaluate', action='store_true', help='only compare the keyword tags with the tags of the export')
+    args = parser.parse_args()
+
+    if args.evaluate:
+        with pd.option_context('display.width', 120):
+            print(evaluate(pd.read_csv(args.csv)))
+        raise SystemExit
+
+    out = args.out or f'{os.path.splitext(args.csv)[0]}-tagged.csv'
+    started = time.perf_counter()
+    count = tag_csv(args.csv, out, args.processes, args.chunksize, args.retag)
+    seconds = time.perf_counter() - started
+    print(f'Tagged {count} reviews to {out} in {seconds:.1f}s ({count / max(seconds, 1e-9):,.0f} reviews/s, '
+          f'{args.processes or os.cpu_count()} processes)')
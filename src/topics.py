@@ -0,0 +1,41 @@
+# Topic flag columns of the review exports, in their column order
+TOPIC_COLUMNS = ['Kundenservice', 'Beratung', 'Freundlichkeit', 'Fahrzeugübergabe', 'Zubehör', 'Werkstattservice', 'Preis-Leistungs-Verhältnis', 'Sauberkeit', 'Fahrzeugqualität', 'Flexibilität', 'Zuverlässigkeit', 'Terminvereinbarung', 'Lieferzeit', 'Garantieabwicklung', 'Reparaturqualität', 'Auswahl']
+
+# Topics shown on the dashboard, in the order of the topic dropdown. Fahrzeugqualität and
+# Flexibilität are tagged in the exports but not shown.
+DASHBOARD_TOPICS = ['Kundenservice', 'Beratung', 'Freundlichkeit', 'Fahrzeugübergabe', 'Zubehör', 'Werkstattservice', 'Preis-Leistungs-Verhältnis', 'Sauberkeit', 'Zuverlässigkeit', 'Terminvereinbarung', 'Lieferzeit', 'Garantieabwicklung', 'Reparaturqualität', 'Auswahl']
+
+# Word stems that tag a review with a topic when they occur anywhere in it (German
+# compounds put them mid-word, e.g. "Riesenauswahl"). Written normalized like the
+# search index: lower case, ä/ö/ü as ae/oe/ue, ß as ss.
+TOPIC_KEYWORDS = {
+    'Kundenservice': ['kundenservice', 'kundendienst', 'service', 'hilfsbereit', 'kuemmer', 'ansprechpartner',
+                      'erreichbar', 'rueckruf', 'zurueckgerufen', 'kundenorientiert', 'kundenfreundlich', 'support'],
+    'Beratung': ['berat', 'kompeten', 'fachkundig', 'fachmaennisch', 'fachwissen', 'erklaer', 'verkaeufer',
+                 'verkaufsgespraech', 'informiert', 'geduldig'],
+    'Freundlichkeit': ['freundlich', 'nett', 'hoeflich', 'sympathisch', 'herzlich', 'zuvorkommend', 'willkommen',
+                       'angenehm', 'unhoeflich', 'arrogant'],
+    'Fahrzeugübergabe': ['uebergabe', 'uebergeben', 'abholung', 'abgeholt', 'einweisung', 'eingewiesen',
+                         'auslieferung', 'ausgeliefert'],
+    'Zubehör': ['zubehoer', 'shop', 'store', 'ersatzteil', 'markise', 'vorzelt', 'campingartikel', 'fahrradtraeger',
+                'solaranlage', 'sat-anlage', 'satanlage', 'camping-artikel'],
+    'Werkstattservice': ['werkstatt', 'inspektion', 'wartung', 'einbau', 'eingebaut', 'montage', 'montiert',
+                         'gaspruefung', 'dichtigkeitspruefung', 'mechaniker', 'techniker'],
+    'Preis-Leistungs-Verhältnis': ['preis', 'guenstig', 'teuer', 'rabatt', 'kosten', 'euro', '€', 'fair',
+                                   'rechnung', 'bezahl', 'nachlass', 'ueberteuert'],
+    'Sauberkeit': ['sauber', 'gepflegt', 'ordentlich', 'schmutz', 'dreck', 'toilette', 'aufgeraeumt', 'hygien',
+                   'gereinigt'],
+    'Fahrzeugqualität': ['qualitaet', 'verarbeitung', 'mangel', 'maengel', 'defekt', 'undicht', 'wasserschaden',
+                         'feuchtigkeit', 'kaputt', 'neufahrzeug', 'hersteller'],
+    'Flexibilität': ['flexib', 'spontan', 'kurzfristig', 'unkompliziert', 'entgegenkommen', 'sonderwunsch',
+                     'individuell', 'moeglich gemacht', 'ausnahme'],
+    'Zuverlässigkeit': ['zuverlaessig', 'verlaesslich', 'puenktlich', 'termingerecht', 'wie vereinbart',
+                        'wie besprochen', 'eingehalten', 'versprochen', 'vertrauen', 'serioes'],
+    'Terminvereinbarung': ['termin', 'wartezeit', 'warteliste', 'telefonisch', 'anmeldung', 'buchung', 'gebucht'],
+    'Lieferzeit': ['lieferzeit', 'lieferung', 'geliefert', 'lieferbar', 'liefertermin', 'verspaetung',
+                   'verzoegerung', 'lange gewartet', 'bestellt', 'bestellung'],
+    'Garantieabwicklung': ['garantie', 'gewaehrleistung', 'reklamation', 'reklamier', 'kulanz', 'kulant'],
+    'Reparaturqualität': ['repar', 'behoben', 'instandsetz', 'fehler', 'schaden', 'nachbesser', 'nachgebessert'],
+    'Auswahl': ['auswahl', 'riesig', 'vielfalt', 'sortiment', 'ausstellung', 'ausgestellt', 'vielzahl', 'modelle',
+                'marken', 'angebot', 'fahrzeuge', 'gebrauchte', 'gebrauchtwagen'],
+}